@@ -1,23 +1,92 @@
-from flask import Flask, render_template, request, redirect, url_for, g, flash, session
+from flask import Flask, render_template, request, redirect, url_for, g, flash, session, jsonify, Response, \
+    send_from_directory, stream_with_context, get_flashed_messages
+import hashlib
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
+import json
+import mimetypes
 import sqlite3
 import requests
-import json
-from werkzeug.security import generate_password_hash, check_password_hash
+from assets import BUILD_DIR, AssetManifest, build_assets, is_immutable
 from config import Config
 from forms import LoginForm, RegisterForm, ShopRegisterForm, BookForm, ShopUpdateForm
+from cache import Cache, LocalVersions, LRUCache, SQLiteVersions
+from database import get_pool, immediate_transaction
+from http_client import UpstreamClient
+from idempotency import IN_PROGRESS, IdempotencyStore
+from images import ImagePipeline, ImageTooLarge
+from pagination import keyset_page
+from passwords import AttemptLimiter, HasherBusy, PasswordHasher
+from search import match_expression
+import migrate
 import os
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
 from werkzeug.utils import secure_filename
+from workers import WorkerPool
 
 app = Flask(__name__)
 app.config.from_object(Config)
 
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+image_pipeline = ImagePipeline(app.config['UPLOAD_FOLDER'], max_bytes=app.config['IMAGE_MAX_BYTES'],
+                               workers=app.config['IMAGE_WORKERS'])
+app.jinja_env.globals['image_variant'] = image_pipeline.variant
+jinja_cache_dir = app.config['JINJA_CACHE_DIR'] or os.path.join(app.instance_path, 'jinja_cache')
+os.makedirs(jinja_cache_dir, exist_ok=True)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(jinja_cache_dir)
+asset_manifest = AssetManifest(app.static_folder)
+
+
+@app.url_defaults
+def fingerprint_static_urls(endpoint, values):
+    # url_for('static', filename='styles.css') points at the fingerprinted build copy when one exists.
+    if endpoint == 'static' and 'filename' in values:
+        built = asset_manifest.lookup(values['filename'])
+        if built:
+            values['filename'] = built
+
+
+def serve_static(filename):
+    """Serve static files, preferring precompressed build copies and caching fingerprinted files forever."""
+    path, encoding = filename, None
+    if filename.startswith(BUILD_DIR + '/'):
+        for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if request.accept_encodings[candidate] and os.path.isfile(os.path.join(app.static_folder, filename + suffix)):
+                path, encoding = filename + suffix, candidate
+                break
+    immutable = is_immutable(filename)
+    response = send_from_directory(app.static_folder, path, mimetype=mimetypes.guess_type(filename)[0],
+                                   max_age=365 * 24 * 3600 if immutable else None)
+    if filename.startswith(BUILD_DIR + '/'):
+        response.vary.add('Accept-Encoding')
+    if encoding:
+        response.content_encoding = encoding
+    if immutable:
+        response.cache_control.immutable = True
+    return response
+
+
+app.view_functions['static'] = serve_static
+
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Fingerprint and precompress static files into static/build/."""
+    manifest = build_assets(app.static_folder)
+    print(f'Built {len(manifest)} assets into {os.path.join(app.static_folder, BUILD_DIR)}')
+
+def db_pool():
+    return get_pool(app.config['DATABASE'], size=app.config['DB_POOL_SIZE'])
+
 
 def get_db():
     if 'db' not in g:
-        g.db = sqlite3.connect(app.config['DATABASE'])
-        g.db.row_factory = sqlite3.Row
+        g.db = db_pool().acquire()
     return g.db
 
 
@@ -25,14 +94,248 @@ def get_db():
 def close_db(exception):
     db = g.pop('db', None)
     if db is not None:
-        db.close()
+        db_pool().release(db)
+
+
+if app.config['AUTO_MIGRATE']:
+    with app.app_context():
+        migrate.upgrade(get_db())
+
+
+catalog_cache = Cache(
+    SQLiteVersions(db_pool(), app.config['CACHE_VERSION_POLL_INTERVAL'], maxsize=app.config['CACHE_MAX_ENTRIES'])
+    if app.config['CACHE_BACKEND'] == 'sqlite' else LocalVersions(),
+    maxsize=app.config['CACHE_MAX_ENTRIES'], ttl=app.config['CACHE_TTL'])
+
+
+payment_idempotency = IdempotencyStore(db_pool(), 'app.payment', ttl=app.config['IDEMPOTENCY_TTL'],
+                                       lease=app.config['IDEMPOTENCY_LEASE_SECONDS'],
+                                       max_entries=app.config['IDEMPOTENCY_MAX_ENTRIES'])
+
+password_hasher = PasswordHasher(
+    app.config['PASSWORD_HASH_METHOD'], app.config['PASSWORD_HASH_ITERATIONS'],
+    workers=app.config['PASSWORD_HASH_WORKERS'], max_pending=app.config['PASSWORD_HASH_QUEUE_DEPTH'],
+    timeout=app.config['PASSWORD_HASH_TIMEOUT'])
+login_limiter = AttemptLimiter({'account': app.config['LOGIN_MAX_FAILURES_PER_ACCOUNT'],
+                                'account_global': app.config['LOGIN_MAX_FAILURES_PER_ACCOUNT_GLOBAL'],
+                                'ip': app.config['LOGIN_MAX_FAILURES_PER_IP']},
+                               window=app.config['LOGIN_FAILURE_WINDOW'],
+                               windows={'account_global': app.config['LOGIN_ACCOUNT_GLOBAL_WINDOW']})
+
+
+def upstream_client(name, base_url):
+    return UpstreamClient(
+        name, base_url,
+        connect_timeout=app.config['UPSTREAM_CONNECT_TIMEOUT'], read_timeout=app.config['UPSTREAM_READ_TIMEOUT'],
+        retries=app.config['UPSTREAM_RETRIES'], pool_size=app.config['UPSTREAM_POOL_SIZE'],
+        failure_threshold=app.config['UPSTREAM_FAILURE_THRESHOLD'], reset_timeout=app.config['UPSTREAM_RESET_TIMEOUT'])
+
+
+payment_client = upstream_client('payment', app.config['PAYMENT_SERVICE_URL'])
+shipment_client = upstream_client('shipment', app.config['SHIPMENT_SERVICE_URL'])
+
+
+def get_categories():
+    return catalog_cache.get_or_load('categories', 'all', lambda: get_db().execute(
+        'SELECT category_id, category_name FROM categories ORDER BY category_name').fetchall())
+
+
+def get_payment_methods():
+    return catalog_cache.get_or_load('paymentmethods', 'all', lambda: get_db().execute(
+        'SELECT method_id, method_name FROM paymentmethods ORDER BY method_id').fetchall())
 
 
+def get_book(book_id):
+    """The book row joined with its category name, or None."""
+    return catalog_cache.get_or_load(f'book:{book_id}', book_id, lambda: get_db().execute('''
+        SELECT books.*, categories.category_name
+        FROM books
+        LEFT JOIN categories ON books.category_id = categories.category_id
+        WHERE books.book_id = ?
+    ''', (book_id,)).fetchone())
+
+
+def invalidate_book(book_id=None):
+    """Drop cached catalog pages and, if given, the cached row of one book."""
+    if book_id is None:
+        catalog_cache.invalidate('catalog')
+    else:
+        catalog_cache.invalidate('catalog', f'book:{book_id}')
+    # Page keys embed the versions just bumped, so this only frees memory early in this process.
+    page_cache.clear()
+
+
+# Rendered pages, keyed by their ETag. Other processes see the version bump within the poll interval.
+page_cache = LRUCache(maxsize=app.config['PAGE_CACHE_MAX_ENTRIES'], ttl=app.config['PAGE_CACHE_TTL'])
+RELEASE_ID = app.config['RELEASE_ID'] or str(int(time.time()))
+
+
+@app.template_global()
+def book_card(book):
+    """The catalog card of a book row, rendered once per book version and then served from catalog_cache."""
+    img_url = book['img_url']
+    # The markup also depends on the category name and on which cover variants exist yet.
+    key = ('card', book['category_name'],
+           bool(image_pipeline.variant(img_url, 'card')), bool(image_pipeline.variant(img_url, 'card', 'webp')))
+    return Markup(catalog_cache.get_or_load(f"book:{book['book_id']}", key,
+                                            lambda: render_template('customer/_book_card.html', book=book)))
+
+
+def versioned_page(namespaces, render, shared=False):
+    """Serve `render()` with an ETag and Last-Modified taken from the catalog cache versions of `namespaces`.
+
+    A matching If-None-Match (or a fresh enough If-Modified-Since) gets 304 without rendering.
+    With `shared=True`, renders for anonymous visitors are also kept in `page_cache` and served to
+    every other anonymous visitor until one of the namespaces is invalidated. Pending flashed
+    messages are shown by the next full render, so while there are any the page is always rendered.
+    """
+    versions = [catalog_cache.version(namespace) for namespace in namespaces]
+    flashes = bool(session.get('_flashes'))
+    anonymous = shared and session.get('role') is None and not flashes
+    # Everything from the session that the templates print goes into the validator.
+    viewer = 'anonymous' if anonymous else (session.get('role'), session.get('user_id'), session.get('username'),
+                                            session.get('shop_id'), session.get('shop_name'))
+    # A render that shows flashes gets its own ETag, so it is never revalidated once they are gone.
+    etag = hashlib.sha1(repr((RELEASE_ID, request.full_path, viewer, versions,
+                              session.get('_flashes'))).encode()).hexdigest()
+    last_modified = datetime.fromtimestamp(max(versions) // 1000, timezone.utc) if max(versions) else None
+
+    def finish(response):
+        response.set_etag(etag, weak=True)
+        if last_modified:
+            response.last_modified = last_modified
+        response.cache_control.no_cache = True
+        response.cache_control.public = anonymous
+        response.cache_control.private = not anonymous
+        return response
+
+    if flashes:
+        not_modified = False
+    elif request.if_none_match:
+        not_modified = request.if_none_match.contains_weak(etag)
+    else:
+        not_modified = bool(last_modified and request.if_modified_since and request.if_modified_since >= last_modified)
+    if not_modified:
+        return finish(app.response_class(status=304))
+
+    body = page_cache.get(etag) if anonymous else None
+    if body is None:
+        body = render()
+        if anonymous:
+            page_cache.set(etag, body)
+    return finish(app.response_class(body, mimetype='text/html'))
+
+
+def stream_page(template_name, **context):
+    """Render a template as a streamed response, so rows are sent while the cursor is still being read.
+
+    Template output is flushed in groups of STREAM_BUFFER_SIZE pieces rather than one write per
+    expression. Flashed messages are popped before streaming starts: the session cookie goes out
+    with the headers, so popping them mid-stream would never be saved.
+    """
+    get_flashed_messages(with_categories=True)
+    app.update_template_context(context)
+    stream = app.jinja_env.get_template(template_name).stream(context)
+    stream.enable_buffering(app.config['STREAM_BUFFER_SIZE'])
+    return app.response_class(stream_with_context(stream), mimetype='text/html')
+
+
+@app.cli.command('migrate')
+def migrate_command():
+    """Apply pending schema migrations."""
+    for number, name in migrate.upgrade(get_db()):
+        print(f'Applied {number:04d}_{name}')
+    print(f'Schema version: {migrate.current_version(get_db())}')
+
+
+# Recomputes the incrementally maintained shop_stats rows (see migrations/0004_shop_stats.sql).
+REBUILD_SHOP_STATS = '''
+INSERT INTO shop_stats (shop_id, books_sold, total_sales, total_stock)
+SELECT shop.shop_id, IFNULL(sales.books_sold, 0), IFNULL(sales.total_sales, 0), IFNULL(stock.total_stock, 0)
+FROM shop
+LEFT JOIN (
+    SELECT orderitems.shop_id, SUM(orderitems.quantity) AS books_sold, SUM(orderitems.total_price) AS total_sales
+    FROM orders JOIN orderitems ON orders.order_id = orderitems.order_id
+    WHERE orders.status = 'paid'
+    GROUP BY orderitems.shop_id
+) AS sales ON sales.shop_id = shop.shop_id
+LEFT JOIN (
+    SELECT shop_id, SUM(stock) AS total_stock FROM books GROUP BY shop_id
+) AS stock ON stock.shop_id = shop.shop_id
+'''
+
+
+@app.cli.command('rebuild-shop-stats')
+def rebuild_shop_stats_command():
+    """Recompute shop_stats from orders, orderitems and books."""
+    db = get_db()
+    with db:
+        db.execute('DELETE FROM shop_stats')
+        db.execute(REBUILD_SHOP_STATS)
+    print(f"Rebuilt stats for {db.execute('SELECT COUNT(*) FROM shop_stats').fetchone()[0]} shops")
+
+
+@app.template_filter('format_currency')
 def format_currency(value):
     if value is None:
         return "Rp0"  # Atau format default lainnya
     return f'Rp{value:,.0f}'.replace(',', '.')
 
+def shop_orders_page(db, shop_id, endpoint, default_status=None, shipped_only=False):
+    """One page of a shop's orders, one row per order, filtered by the request's query string.
+
+    Recognised arguments: status, date_from, date_to (YYYY-MM-DD), sort (date_desc or date_asc),
+    limit and the after/before cursors. item_count and shop_subtotal only cover the lines
+    sold by this shop. Returns (rows, next_url, prev_url).
+    """
+    where, params = ['shop_orders.shop_id = ?'], [shop_id]
+    status = request.args.get('status', default_status)
+    if status:
+        where.append('shop_orders.status = ?')
+        params.append(status)
+    date_from = request.args.get('date_from')
+    if date_from:
+        where.append('shop_orders.sort_date >= ?')
+        params.append(date_from)
+    date_to = request.args.get('date_to')
+    if date_to:
+        where.append("shop_orders.sort_date < date(?, '+1 day')")
+        params.append(date_to)
+    if shipped_only:
+        where.append('EXISTS (SELECT 1 FROM shipment WHERE shipment.order_id = shop_orders.order_id)')
+    limit = request.args.get('limit', app.config['ORDERS_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, app.config['ORDERS_MAX_PAGE_SIZE']))
+
+    # Pick the page's orders off the shop_orders index first, then aggregate just those.
+    page = keyset_page(
+        db, 'SELECT shop_orders.order_id, shop_orders.sort_date FROM shop_orders',
+        where, params, [('shop_orders.sort_date', 'sort_date'), ('shop_orders.order_id', 'order_id')],
+        descending=request.args.get('sort') != 'date_asc', limit=limit,
+        after=request.args.get('after'), before=request.args.get('before'))
+    order_ids = [row['order_id'] for row in page.rows]
+    details = {}
+    if order_ids:
+        details = {row['order_id']: row for row in db.execute(
+            '''
+            SELECT orders.order_id, orders.buyer_id, orders.order_date, orders.subtotal, orders.total,
+                   orders.status, orders.delivery_address,
+                   COUNT(orderitems.order_item_id) AS item_count,
+                   SUM(orderitems.total_price) AS shop_subtotal,
+                   (SELECT shipment.status FROM shipment WHERE shipment.order_id = orders.order_id
+                    ORDER BY shipment.shipment_id DESC LIMIT 1) AS shipment_status
+            FROM orders
+            JOIN orderitems ON orderitems.order_id = orders.order_id AND orderitems.shop_id = ?
+            WHERE orders.order_id IN (SELECT value FROM json_each(?))
+            GROUP BY orders.order_id
+            ''', (shop_id, json.dumps(order_ids))).fetchall()}
+    rows = [details[order_id] for order_id in order_ids if order_id in details]
+
+    args = {k: v for k, v in request.args.items() if k not in ('after', 'before')}
+    next_url = url_for(endpoint, after=page.next_cursor, **args) if page.next_cursor else None
+    prev_url = url_for(endpoint, before=page.prev_cursor, **args) if page.prev_cursor else None
+    return rows, next_url, prev_url
+
+
 @app.route('/shop/dashboard')
 def shop_dashboard():
     if session.get('role') != 'shop':
@@ -42,57 +345,14 @@ def shop_dashboard():
     db = get_db()
     shop_id = session.get('shop_id')
 
-    query_total_books = '''
-    SELECT 
-        SUM(orderitems.quantity) AS total_books_sold
-    FROM 
-        orders
-    JOIN orderitems
-    ON 
-        orders.order_id = orderitems.order_id
-    WHERE 
-        orders.status = 'paid' AND
-        orderitems.shop_id = ?
-    '''
-    cur = db.execute(query_total_books, (shop_id,))
-    total_books_sold = cur.fetchone()['total_books_sold']
+    stats = db.execute('SELECT books_sold, total_sales FROM shop_stats WHERE shop_id = ?', (shop_id,)).fetchone()
+    total_books_sold = stats['books_sold'] if stats else 0
+    total_sales = stats['total_sales'] if stats else 0
 
-    query_total_sales = '''
-    SELECT 
-        SUM(orderitems.total_price) AS total_sales
-    FROM 
-        orders
-    JOIN orderitems
-    ON 
-        orders.order_id = orderitems.order_id
-    WHERE 
-        orders.status = 'paid' AND
-        orderitems.shop_id = ?
-    '''
-    cur = db.execute(query_total_sales, (shop_id,))
-    total_sales = cur.fetchone()['total_sales']
-
-    query_orders = '''
-    SELECT 
-    orders.order_id, orders.buyer_id, 
-    orders.order_date, orders.subtotal, orders.total, 
-    orders.status, orders.delivery_address
-
-    FROM 
-        orders
-    JOIN orderitems
-    ON 
-        orders.order_id = orderitems.order_id
-    WHERE 
-        orders.status = 'paid' AND
-        orderitems.shop_id = ?
-    
-    '''
+    orders, next_url, prev_url = shop_orders_page(db, shop_id, 'shop_dashboard', default_status='paid')
 
-    cur = db.execute(query_orders, (shop_id,))
-    orders = cur.fetchall()
-    
-    return render_template('shop/dashboard.html', orders=orders, total_books_sold=total_books_sold, total_sales=total_sales)
+    return stream_page('shop/dashboard.html', orders=orders, total_books_sold=total_books_sold, total_sales=total_sales,
+                       next_url=next_url, prev_url=prev_url)
 
 @app.route('/shop/detail_order/<int:order_id>', methods=['GET', 'POST'])
 def detail_order(order_id):
@@ -132,29 +392,181 @@ def index():
         template = 'customer/buyer_index.html'
     elif session.get('role') == 'shop':
         template = 'shop/shop_index.html'
-    return render_template(template, books=[], format_currency=format_currency)
+    return versioned_page(['catalog'], lambda: render_template(template, books=[]), shared=True)
+
+# Login table, id column and name column for each role.
+LOGIN_ACCOUNTS = {
+    'admin': ('admin', 'admin_id', 'admin_name'),
+    'buyer': ('buyer', 'buyer_id', 'username'),
+    'shop': ('shop', 'shop_id', 'shop_name'),
+}
+
+
+def authenticate(role, name, password):
+    """Check a login for `role`; returns (row, refusal).
+
+    row is the matching account on success. refusal is None for a plain wrong name or password,
+    or a (message, status_code, headers) tuple when the attempt was turned away before checking
+    (too many failures for this account or address) or the hasher is saturated.
+    """
+    table, id_column, name_column = LOGIN_ACCOUNTS[role]
+    ip = request.remote_addr or ''
+    # Account failures are counted per client address, so one address cannot lock a known account
+    # out quickly; the slower global account budget caps guesses spread over many addresses, and
+    # the per-address budget caps guessing across many accounts.
+    keys = [('account', f'{role}:{name}@{ip}'), ('account_global', f'{role}:{name}'), ('ip', ip)]
+    # The attempt is counted before the hash check, so a burst of parallel guesses cannot all
+    # get past the limit while the first ones are still being hashed.
+    wait = login_limiter.reserve(keys)
+    if wait:
+        return None, ('Too many failed login attempts. Please try again later.', 429,
+                      {'Retry-After': str(int(wait) + 1)})
+
+    db = get_db()
+    account = db.execute(f'SELECT {id_column}, {name_column}, password FROM {table} WHERE {name_column} = ?',
+                         (name,)).fetchone()
+    try:
+        ok = account is not None and password_hasher.verify(account['password'], password)
+    except HasherBusy:
+        login_limiter.refund(keys)
+        return None, ('The server is busy. Please try again in a moment.', 503, {'Retry-After': '1'})
+    if not ok:
+        return None, None
+
+    login_limiter.refund(keys)
+    if password_hasher.needs_rehash(account['password']):
+        try:
+            db.execute(f'UPDATE {table} SET password = ? WHERE {id_column} = ?',
+                       (password_hasher.hash(password), account[id_column]))
+            db.commit()
+        except HasherBusy:
+            pass  # upgraded on a later login
+    return account, None
+
+
+def login_failed(refusal, message):
+    """Flash why a login failed; returns the (status, headers) to render the form with."""
+    message, status, headers = refusal or (message, 200, {})
+    flash(message, 'danger')
+    return status, headers
+
 
 @app.route('/admin/login', methods=['GET', 'POST'])
 def admin_login():
     form = LoginForm()
+    status, headers = 200, {}
     if form.validate_on_submit():
         admin_name = form.username.data
         password = form.password.data
 
-        db = get_db()
-        cur = db.execute('SELECT * FROM admin WHERE admin_name = ?', (admin_name,))
-        admin = cur.fetchone()
+        admin, refusal = authenticate('admin', admin_name, password)
 
-        if admin and check_password_hash(admin['password'], password):
+        if admin:
             session['admin_id'] = admin['admin_id']
             session['admin_name'] = admin['admin_name']
             session['role'] = 'admin'
             flash('Admin login successful!', 'success')
             return redirect(url_for('admin_dashboard'))
         else:
-            flash('Invalid admin name or password.', 'danger')
+            status, headers = login_failed(refusal, 'Invalid admin name or password.')
+
+    return render_template('admin/admin_login.html', form=form), status, headers
+
+# Admin console listings: table, id column, displayed columns (never the password hash) and the
+# columns matched by the search box.
+ADMIN_ACCOUNTS = {
+    'buyers': ('buyer', 'buyer_id', ('buyer_id', 'username', 'dob', 'email', 'phone_number', 'buyer_address'),
+               ('username', 'email')),
+    'shops': ('shop', 'shop_id', ('shop_id', 'shop_name', 'owner_name', 'shop_phone', 'shop_address', 'shop_email',
+                                  'shop_description', 'isverified'),
+              ('shop_name', 'shop_email')),
+}
+
+
+def admin_accounts_page(db, kind, endpoint, url_args=None):
+    """One keyset page of buyers or shops, newest first, filtered by the request's query string.
+
+    Recognised arguments: q (case-insensitive prefix of the name or email), verified (shops
+    only, 1 or 0), limit and the after/before cursors. `url_args` are added to the page links.
+    Returns (rows, next_url, prev_url).
+    """
+    table, id_column, columns, searched = ADMIN_ACCOUNTS[kind]
+    where, params = [], []
+    q = (request.args.get('q') or '').strip()
+    if q:
+        pattern = q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        where.append('(' + ' OR '.join(f"{column} LIKE ? ESCAPE '\\'" for column in searched) + ')')
+        params.extend([pattern] * len(searched))
+    verified = request.args.get('verified')
+    if kind == 'shops' and verified == '1':
+        where.append('isverified = 1')
+    elif kind == 'shops' and verified == '0':
+        # Same expression as idx_shop_unverified, so the pending queue is read from that index.
+        where.append('IFNULL(isverified, 0) != 1')
+    limit = request.args.get('limit', app.config['ADMIN_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, app.config['ADMIN_MAX_PAGE_SIZE']))
+
+    page = keyset_page(db, f'SELECT {", ".join(columns)} FROM {table}', where, params,
+                       [(id_column, id_column)], descending=True, limit=limit,
+                       after=request.args.get('after'), before=request.args.get('before'))
+
+    args = {k: v for k, v in request.args.items() if k not in ('after', 'before')}
+    args.update(url_args or {})
+    next_url = url_for(endpoint, after=page.next_cursor, **args) if page.next_cursor else None
+    prev_url = url_for(endpoint, before=page.prev_cursor, **args) if page.prev_cursor else None
+    return page.rows, next_url, prev_url
+
+
+def account_counts(db):
+    counts = {row['name']: row['value'] for row in db.execute('SELECT name, value FROM account_counts')}
+    counts.setdefault('buyers', 0)
+    counts.setdefault('shops', 0)
+    counts.setdefault('verified_shops', 0)
+    counts['pending_shops'] = counts['shops'] - counts['verified_shops']
+    return counts
+
+
+def posted_ids():
+    """IDs sent as a JSON {"ids": [...]} body or as repeated `ids` form fields; None if malformed."""
+    if request.is_json:
+        body = request.get_json(silent=True)
+        ids = body.get('ids') if isinstance(body, dict) else None
+    else:
+        ids = request.form.getlist('ids')
+    if not isinstance(ids, list):
+        return None
+    try:
+        return sorted({int(account_id) for account_id in ids})
+    except (TypeError, ValueError):
+        return None
+
+
+def bulk_response(message, kind, status_code=200, **data):
+    """Answer a bulk moderation request: JSON for API callers, a flash and redirect for the dashboard form."""
+    if request.is_json:
+        return jsonify({'status': 'success' if status_code == 200 else 'error', 'message': message,
+                        'data': data}), status_code
+    flash(message, 'success' if status_code == 200 else 'danger')
+    return redirect(url_for('admin_dashboard', view=kind))
+
+
+def admin_bulk_ids(kind):
+    """Validate a bulk request; returns (ids, None) or (None, error response)."""
+    if 'admin_id' not in session:
+        if request.is_json:
+            return None, (jsonify({'status': 'error', 'message': 'Admin login required.'}), 403)
+        flash('You must be logged in as an admin to perform this action.', 'danger')
+        return None, redirect(url_for('admin_login'))
+    if kind not in ADMIN_ACCOUNTS:
+        return None, bulk_response('Invalid user type.', 'shops', 404)
+    ids = posted_ids()
+    if not ids:
+        return None, bulk_response('Select at least one account.', kind, 400)
+    if len(ids) > app.config['ADMIN_BULK_MAX_IDS']:
+        return None, bulk_response(f"At most {app.config['ADMIN_BULK_MAX_IDS']} accounts can be changed at once.",
+                                   kind, 413)
+    return ids, None
 
-    return render_template('admin/admin_login.html', form=form)
 
 @app.route('/admin/dashboard')
 def admin_dashboard():
@@ -163,9 +575,71 @@ def admin_dashboard():
         return redirect(url_for('admin_login'))
 
     db = get_db()
-    buyers = db.execute('SELECT * FROM buyer').fetchall()
-    shops = db.execute('SELECT * FROM shop').fetchall()
-    return render_template('admin/admin_dashboard.html', buyers=buyers, shops=shops)
+    view = request.args.get('view', 'shops')
+    if view not in ADMIN_ACCOUNTS:
+        view = 'shops'
+    accounts, next_url, prev_url = admin_accounts_page(db, view, 'admin_dashboard')
+    return stream_page('admin/admin_dashboard.html', view=view, accounts=accounts, counts=account_counts(db),
+                       next_url=next_url, prev_url=prev_url)
+
+
+@app.route('/admin/accounts')
+def admin_account_counts():
+    if 'admin_id' not in session:
+        return jsonify({'status': 'error', 'message': 'Admin login required.'}), 403
+    return jsonify({'status': 'success', 'data': account_counts(get_db())})
+
+
+@app.route('/admin/accounts/<kind>')
+def admin_accounts(kind):
+    if 'admin_id' not in session:
+        return jsonify({'status': 'error', 'message': 'Admin login required.'}), 403
+    if kind not in ADMIN_ACCOUNTS:
+        return jsonify({'status': 'error', 'message': 'Invalid user type.'}), 404
+    db = get_db()
+    rows, next_url, prev_url = admin_accounts_page(db, kind, 'admin_accounts', {'kind': kind})
+    return jsonify({'status': 'success', 'data': [dict(row) for row in rows], 'counts': account_counts(db),
+                    'next': next_url, 'prev': prev_url})
+
+
+@app.route('/admin/accounts/shops/verify', methods=['POST'])
+def admin_bulk_verify():
+    ids, error = admin_bulk_ids('shops')
+    if error:
+        return error
+    db = get_db()
+    with immediate_transaction(db):
+        verified = db.execute('''
+            UPDATE shop SET isverified = 1
+            WHERE shop_id IN (SELECT value FROM json_each(?)) AND IFNULL(isverified, 0) != 1
+        ''', (json.dumps(ids),)).rowcount
+    if verified:
+        invalidate_book()
+    return bulk_response(f'{verified} shop(s) verified.', 'shops', verified=verified)
+
+
+@app.route('/admin/accounts/<kind>/delete', methods=['POST'])
+def admin_bulk_delete(kind):
+    ids, error = admin_bulk_ids(kind)
+    if error:
+        return error
+    table, id_column = ADMIN_ACCOUNTS[kind][:2]
+    db = get_db()
+    deleted, blocked = [], []
+    with immediate_transaction(db):
+        for account_id in ids:
+            try:
+                if db.execute(f'DELETE FROM {table} WHERE {id_column} = ?', (account_id,)).rowcount:
+                    deleted.append(account_id)
+            except sqlite3.IntegrityError:
+                # A failed foreign key check only undoes this statement; the rest of the batch commits together.
+                blocked.append(account_id)
+    if kind == 'shops' and deleted:
+        invalidate_book()
+    message = f'{len(deleted)} {kind} deleted.'
+    if blocked:
+        message += f' {len(blocked)} still have carts, orders or books and were kept.'
+    return bulk_response(message, kind, deleted=deleted, blocked=blocked)
 
 
 @app.route('/admin/delete/<user_type>/<int:user_id>', methods=['POST'])
@@ -175,17 +649,33 @@ def admin_delete(user_type, user_id):
         return redirect(url_for('admin_login'))
 
     db = get_db()
-    if user_type == 'buyer':
-        db.execute('DELETE FROM buyer WHERE buyer_id = ?', (user_id,))
-    elif user_type == 'shop':
-        db.execute('DELETE FROM shop WHERE shop_id = ?', (user_id,))
-    else:
-        flash('Invalid user type.', 'danger')
-        return redirect(url_for('admin_dashboard'))
+    try:
+        if user_type == 'buyer':
+            db.execute('DELETE FROM buyer WHERE buyer_id = ?', (user_id,))
+        elif user_type == 'shop':
+            db.execute('DELETE FROM shop WHERE shop_id = ?', (user_id,))
+        else:
+            flash('Invalid user type.', 'danger')
+            return redirect(url_for('admin_dashboard'))
+        db.commit()
+    except sqlite3.IntegrityError:
+        db.rollback()
+        flash(f'{user_type.capitalize()} still has carts, orders or books and cannot be deleted.', 'danger')
+        return redirect(url_for('admin_dashboard', view=user_type + 's'))
 
-    db.commit()
     flash(f'{user_type.capitalize()} deleted successfully.', 'success')
-    return redirect(url_for('admin_dashboard'))
+    return redirect(url_for('admin_dashboard', view=user_type + 's'))
+
+# Keyset sort orders for the catalog: (sql expression, selected alias) pairs, descending flag.
+# book_id is always the last key so every ordering is total and cursors are stable.
+CATALOG_SORTS = {
+    'relevance': ([('f.rank', 'sort_rank'), ('b.book_id', 'book_id')], False),
+    'date_desc': ([('b.book_id', 'book_id')], True),
+    'price_asc': ([('IFNULL(b.price, 0)', 'sort_price'), ('b.book_id', 'book_id')], False),
+    'price_desc': ([('IFNULL(b.price, 0)', 'sort_price'), ('b.book_id', 'book_id')], True),
+    'name_asc': ([("IFNULL(b.book_name, '')", 'sort_name'), ('b.book_id', 'book_id')], False),
+}
+
 
 @app.route('/buyer_index', methods=['GET'])
 def buyer_index():
@@ -194,8 +684,58 @@ def buyer_index():
         return redirect(url_for('login'))
 
     db = get_db()
-    books = db.execute('SELECT * FROM books').fetchall()
-    return render_template('customer/buyer_index.html', books=books, format_currency=format_currency)
+    match = match_expression(request.args.get('search'))
+    sort = request.args.get('sort') or ('relevance' if match else 'date_desc')
+    if sort == 'relevance' and not match:
+        sort = 'date_desc'
+    keys, descending = CATALOG_SORTS.get(sort, CATALOG_SORTS['date_desc'])
+
+    select_sql = '''
+        SELECT b.book_id, b.book_name, b.author, b.price, b.img_url, c.category_name,
+               IFNULL(b.price, 0) AS sort_price, IFNULL(b.book_name, '') AS sort_name{rank}
+        FROM books b
+        LEFT JOIN categories c ON b.category_id = c.category_id
+    '''
+    where, params = [], []
+    if match:
+        # Join the FTS index only when searching; bm25 rank is its hidden column.
+        select_sql = select_sql.format(rank=', f.rank AS sort_rank') + ' JOIN books_fts f ON f.rowid = b.book_id'
+        where.append('books_fts MATCH ?')
+        params.append(match)
+    else:
+        select_sql = select_sql.format(rank='')
+    category = request.args.get('category', type=int)
+    if category:
+        where.append('b.category_id = ?')
+        params.append(category)
+    price_min = request.args.get('price_min', type=float)
+    if price_min is not None:
+        where.append('IFNULL(b.price, 0) >= ?')
+        params.append(price_min)
+    price_max = request.args.get('price_max', type=float)
+    if price_max is not None:
+        where.append('IFNULL(b.price, 0) <= ?')
+        params.append(price_max)
+    limit = request.args.get('limit', app.config['CATALOG_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, app.config['CATALOG_MAX_PAGE_SIZE']))
+
+    after, before = request.args.get('after'), request.args.get('before')
+
+    def render():
+        page = catalog_cache.get_or_load(
+            'catalog', (select_sql, tuple(where), tuple(params), sort, limit, after, before),
+            lambda: keyset_page(db, select_sql, where, params, keys, descending=descending, limit=limit,
+                                after=after, before=before))
+
+        categories = get_categories()
+        args = {k: v for k, v in request.args.items() if k not in ('after', 'before')}
+        next_url = url_for('buyer_index', after=page.next_cursor, **args) if page.next_cursor else None
+        prev_url = url_for('buyer_index', before=page.prev_cursor, **args) if page.prev_cursor else None
+        return render_template('customer/buyer_index.html', books=page.rows, categories=categories,
+                               next_url=next_url, prev_url=prev_url)
+
+    # Revalidations are answered from the catalog version alone, without querying or rendering.
+    return versioned_page(['catalog', 'categories'], render)
 
 
 @app.route('/shop/order', methods=['Get'])
@@ -207,28 +747,9 @@ def shop_order():
     db = get_db()
     shop_id = session.get('shop_id')
 
-    query = '''
-    SELECT 
-        orders.order_id, orders.buyer_id, 
-        orders.order_date, orders.subtotal, orders.total, 
-        orders.status, orders.delivery_address, shipment.status AS shipment_status
-    FROM 
-        orders
-    JOIN 
-        shipment 
-    ON 
-        orders.order_id = shipment.order_id
-    JOIN orderitems
-    ON 
-        orders.order_id = orderitems.order_id
-    WHERE 
-        orderitems.shop_id = ?
-    '''
-
-    cur = db.execute(query, (shop_id,))
-    orders = cur.fetchall()
+    orders, next_url, prev_url = shop_orders_page(db, shop_id, 'shop_order', shipped_only=True)
 
-    return render_template('shop/orders.html', orders=orders)
+    return stream_page('shop/orders.html', orders=orders, next_url=next_url, prev_url=prev_url)
 
 
 @app.route('/register', methods=['GET', 'POST'])
@@ -242,9 +763,8 @@ def register():
         password = form.password.data
         buyer_address = form.buyer_address.data
 
-        hashed_password = generate_password_hash(password, method='pbkdf2:sha256')
-
         try:
+            hashed_password = password_hasher.hash(password)
             db = get_db()
             db.execute('''INSERT INTO buyer (username, dob, email, phone_number, password, buyer_address) 
                           VALUES (?, ?, ?, ?, ?, ?)''',
@@ -252,6 +772,8 @@ def register():
             db.commit()
             flash('You have successfully registered! Please log in.', 'success')
             return redirect(url_for('login'))
+        except HasherBusy:
+            flash('The server is busy. Please try again in a moment.', 'danger')
         except sqlite3.IntegrityError:
             flash('Username or email already exists.', 'danger')
         except Exception as e:
@@ -263,24 +785,23 @@ def register():
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     form = LoginForm()
+    status, headers = 200, {}
     if form.validate_on_submit():
         username = form.username.data
         password = form.password.data
 
-        db = get_db()
-        cur = db.execute('SELECT * FROM buyer WHERE username = ?', (username,))
-        user = cur.fetchone()
+        user, refusal = authenticate('buyer', username, password)
 
-        if user and check_password_hash(user['password'], password):
+        if user:
             session['user_id'] = user['buyer_id']
             session['username'] = user['username']
             session['role'] = 'buyer'
             flash('Login successful!', 'success')
             return redirect(url_for('buyer_index'))
         else:
-            flash('Invalid username or password.', 'danger')
+            status, headers = login_failed(refusal, 'Invalid username or password.')
 
-    return render_template('customer/login.html', form=form)
+    return render_template('customer/login.html', form=form), status, headers
 
 
 @app.route('/shop/register', methods=['GET', 'POST'])
@@ -295,9 +816,8 @@ def shop_register():
         shop_email = form.shop_email.data
         shop_description = form.shop_description.data
 
-        hashed_password = generate_password_hash(password, method='pbkdf2:sha256')
-
         try:
+            hashed_password = password_hasher.hash(password)
             db = get_db()
             db.execute('''INSERT INTO shop (shop_name, owner_name, shop_phone, shop_address, shop_email, shop_description, password)
                           VALUES (?, ?, ?, ?, ?, ?, ?)''',
@@ -305,6 +825,8 @@ def shop_register():
             db.commit()
             flash('Your shop has been successfully registered! Please log in.', 'success')
             return redirect(url_for('shop_login'))
+        except HasherBusy:
+            flash('The server is busy. Please try again in a moment.', 'danger')
         except sqlite3.IntegrityError:
             flash('Shop name, email or phone number already exists.', 'danger')
         except Exception as e:
@@ -316,15 +838,14 @@ def shop_register():
 @app.route('/shop/login', methods=['GET', 'POST'])
 def shop_login():
     form = LoginForm()
+    status, headers = 200, {}
     if form.validate_on_submit():
         shop_name = form.username.data
         password = form.password.data
 
-        db = get_db()
-        cur = db.execute('SELECT * FROM shop WHERE shop_name = ?', (shop_name,))
-        shop = cur.fetchone()
+        shop, refusal = authenticate('shop', shop_name, password)
 
-        if shop and check_password_hash(shop['password'], password):
+        if shop:
             session['shop_id'] = shop['shop_id']
             session['shop_name'] = shop['shop_name']
             session['role'] = 'shop'
@@ -334,9 +855,9 @@ def shop_login():
             flash('Login successful!', 'success')
             return redirect(url_for('manage_books'))
         else:
-            flash('Invalid shop name or password.', 'danger')
+            status, headers = login_failed(refusal, 'Invalid shop name or password.')
 
-    return render_template('shop/shop_login.html', form=form)
+    return render_template('shop/shop_login.html', form=form), status, headers
 
 @app.route('/admin/verify_shop/<int:shop_id>', methods=['POST'])
 def verify_shop(shop_id):
@@ -347,9 +868,62 @@ def verify_shop(shop_id):
     db = get_db()
     db.execute('UPDATE shop SET isverified = 1 WHERE shop_id = ?', (shop_id,))
     db.commit()
+    invalidate_book()
     flash('Shop verified successfully.', 'success')
     return redirect(url_for('admin_dashboard'))
 
+@app.route('/admin/cache_stats')
+def admin_cache_stats():
+    if 'admin_id' not in session:
+        return jsonify({'status': 'error', 'message': 'Admin login required.'}), 403
+    return jsonify({'status': 'success', 'data': catalog_cache.stats()})
+
+
+@app.route('/admin/upstreams')
+def admin_upstream_stats():
+    if 'admin_id' not in session:
+        return jsonify({'status': 'error', 'message': 'Admin login required.'}), 403
+    return jsonify({'status': 'success', 'data': {
+        client.name: client.stats() for client in (payment_client, shipment_client)
+    }})
+
+
+@app.route('/admin/shipment_outbox')
+def admin_shipment_outbox():
+    if 'admin_id' not in session:
+        return jsonify({'status': 'error', 'message': 'Admin login required.'}), 403
+    db = get_db()
+    counts = db.execute('SELECT status, COUNT(*) AS entries FROM shipment_outbox GROUP BY status').fetchall()
+    dead = db.execute('''
+        SELECT outbox_id, order_id, attempts, error, updated_at FROM shipment_outbox
+        WHERE status = 'dead' ORDER BY outbox_id DESC LIMIT 50
+    ''').fetchall()
+    return jsonify({'status': 'success', 'data': {
+        'counts': {row['status']: row['entries'] for row in counts},
+        'dead': [dict(row) for row in dead],
+    }})
+
+
+@app.route('/admin/shipment_outbox/<int:outbox_id>/retry', methods=['POST'])
+def admin_retry_shipment(outbox_id):
+    if 'admin_id' not in session:
+        return jsonify({'status': 'error', 'message': 'Admin login required.'}), 403
+    db = get_db()
+    try:
+        with db:
+            requeued = db.execute('''
+                UPDATE shipment_outbox
+                SET status = 'pending', attempts = 0, run_after = 0, error = NULL, updated_at = CURRENT_TIMESTAMP
+                WHERE outbox_id = ? AND status = 'dead'
+            ''', (outbox_id,)).rowcount
+    except sqlite3.IntegrityError:
+        return jsonify({'status': 'error', 'message': 'The order already has a live shipment request.'}), 409
+    if not requeued:
+        return jsonify({'status': 'error', 'message': 'No dead-lettered shipment with that id.'}), 404
+    shipment_dispatchers.notify()
+    return jsonify({'status': 'success'})
+
+
 def is_shop_verified(shop_id):
     db = get_db()
     cur = db.execute('SELECT isverified FROM shop WHERE shop_id = ?', (shop_id,))
@@ -365,32 +939,9 @@ def profile():
     db = get_db()
     shop_id = session.get('shop_id')
 
-    query_total_books = '''
-    SELECT 
-        SUM(books.stock) AS total_books
-    FROM 
-        books
-    WHERE 
-        books.shop_id = ?
-    '''
-    cur = db.execute(query_total_books, (shop_id,))
-    total_books = cur.fetchone()['total_books']
-
-    query_total_sales = '''
-    SELECT 
-        SUM(orderitems.total_price) AS total_sales
-    FROM 
-        orders
-    JOIN orderitems
-    ON 
-        orders.order_id = orderitems.order_id
-    WHERE 
-        orders.status = 'paid' AND
-        orderitems.shop_id = ?
-    '''
-    cur = db.execute(query_total_sales, (shop_id,))
-    total_sales = cur.fetchone()['total_sales']
-
+    stats = db.execute('SELECT total_stock, total_sales FROM shop_stats WHERE shop_id = ?', (shop_id,)).fetchone()
+    total_books = stats['total_stock'] if stats else 0
+    total_sales = stats['total_sales'] if stats else 0
 
     cur = db.execute('SELECT * FROM shop WHERE shop_id = ?', (shop_id,))
     shop_data = cur.fetchone()
@@ -460,62 +1011,62 @@ def logout():
 
 @app.route('/book/<int:book_id>')
 def book(book_id):
-    try:
-        db = get_db()
-        cur = db.execute('SELECT * FROM books WHERE book_id = ?', (book_id,))
-        book = cur.fetchone()
+    def render():
+        book = get_book(book_id)
         category_name = None
         if book and book['category_id']:
-            cur = db.execute('SELECT category_name FROM categories WHERE category_id = ?', (book['category_id'],))
-            category = cur.fetchone()
-            category_name = category['category_name'] if category else "No category"
-        return render_template('customer/book.html', book=book, category_name=category_name,
-                               format_currency=format_currency)
+            category_name = book['category_name'] or "No category"
+        return render_template('customer/book.html', book=book, category_name=category_name)
+
+    try:
+        return versioned_page([f'book:{book_id}', 'categories'], render, shared=True)
     except Exception as e:
         flash(f'An error occurred: {e}', 'danger')
         return redirect(url_for('index'))
 
 
 
+# Cart writes rely on the unique indexes from migrations/0006_cart_uniqueness.sql:
+# one open cart per buyer and one cartitems row per (cart_id, book_id).
+OPEN_CART = '''
+    INSERT INTO cart (buyer_id, status)
+    SELECT ?, 'open' WHERE EXISTS (SELECT 1 FROM books WHERE book_id = ?)
+    ON CONFLICT (buyer_id) WHERE status = 'open' DO NOTHING
+'''
+ADD_CART_ITEM = '''
+    INSERT INTO cartitems (cart_id, book_id, quantity)
+    SELECT cart.cart_id, books.book_id, ?
+    FROM cart, books
+    WHERE cart.buyer_id = ? AND cart.status = 'open' AND books.book_id = ?
+    ON CONFLICT (cart_id, book_id) DO UPDATE SET quantity = quantity + excluded.quantity
+'''
+UPSERT_CART_ITEM = '''
+    INSERT INTO cartitems (cart_id, book_id, quantity) VALUES (?, ?, ?)
+    ON CONFLICT (cart_id, book_id) DO UPDATE SET quantity = quantity + excluded.quantity
+'''
+SET_CART_ITEM = '''
+    INSERT INTO cartitems (cart_id, book_id, quantity) VALUES (?, ?, ?)
+    ON CONFLICT (cart_id, book_id) DO UPDATE SET quantity = excluded.quantity
+'''
+
+
 @app.route('/add_to_cart/<int:book_id>', methods=['POST'])
 def add_to_cart(book_id):
     if 'user_id' not in session:
         flash('You need to be logged in to add items to the cart.', 'warning')
         return redirect(url_for('login'))
 
+    quantity = max(1, request.form.get('quantity', 1, type=int) or 1)
     try:
         db = get_db()
-        cur = db.execute('SELECT * FROM books WHERE book_id = ?', (book_id,))
-        book = cur.fetchone()
-
-        if book:
-            # Check if there is an existing open cart for the user
-            cart_cur = db.execute('SELECT cart_id FROM cart WHERE buyer_id = ? AND status = ?',
-                                  (session['user_id'], 'open'))
-            cart_id = cart_cur.fetchone()
-
-            # If no open cart exists, create a new one
-            if not cart_id:
-                db.execute('INSERT INTO cart (buyer_id, status) VALUES (?, ?)',
-                           (session['user_id'], 'open'))
-                cart_id = db.execute('SELECT cart_id FROM cart WHERE buyer_id = ? AND status = ?',
-                                     (session['user_id'], 'open')).fetchone()
-
-            # Check if the book is already in the cart
-            cur = db.execute(
-                'SELECT * FROM cartitems WHERE cart_id = ? AND book_id = ?',
-                (cart_id['cart_id'], book_id)
-            )
-            item = cur.fetchone()
-
-            if item:
-                db.execute('UPDATE cartitems SET quantity = quantity + 1 WHERE cart_item_id = ?',
-                           (item['cart_item_id'],))
-            else:
-                db.execute('INSERT INTO cartitems (cart_id, book_id, quantity) VALUES (?, ?, ?)',
-                           (cart_id['cart_id'], book_id, 1))
-
-            db.commit()
+        with db:
+            # Common case: the buyer already has an open cart, so this single upsert is the whole write.
+            added = db.execute(ADD_CART_ITEM, (quantity, session['user_id'], book_id)).rowcount
+            if not added:
+                db.execute(OPEN_CART, (session['user_id'], book_id))
+                added = db.execute(ADD_CART_ITEM, (quantity, session['user_id'], book_id)).rowcount
+
+        if added:
             flash('Book added to cart!', 'success')
         else:
             flash('Book not found.', 'danger')
@@ -526,6 +1077,58 @@ def add_to_cart(book_id):
         return redirect(url_for('buyer_index'))
 
 
+@app.route('/api/cart/items', methods=['POST'])
+def cart_items_api():
+    """Add or set many cart lines in one transaction.
+
+    Body: {"items": [{"book_id": 1, "quantity": 2}, ...], "mode": "add" | "set"}. With "set",
+    a quantity of 0 removes the line. Responds with the resulting open cart.
+    """
+    if 'user_id' not in session:
+        return jsonify({'status': 'error', 'message': 'You need to be logged in to modify the cart.'}), 401
+
+    data = request.get_json(silent=True) or {}
+    mode = data.get('mode', 'add')
+    items = data.get('items')
+    if mode not in ('add', 'set'):
+        return jsonify({'status': 'error', 'message': 'mode must be "add" or "set"'}), 400
+    if not isinstance(items, list) or not items or len(items) > app.config['CART_BULK_MAX_ITEMS']:
+        return jsonify({'status': 'error',
+                        'message': f"items must be a list of 1 to {app.config['CART_BULK_MAX_ITEMS']} lines"}), 400
+
+    lines = {}
+    for item in items:
+        book_id = item.get('book_id') if isinstance(item, dict) else None
+        quantity = item.get('quantity', 1) if isinstance(item, dict) else None
+        if not isinstance(book_id, int) or not isinstance(quantity, int) or quantity < (0 if mode == 'set' else 1):
+            return jsonify({'status': 'error', 'message': f'Invalid cart line: {item}'}), 400
+        lines[book_id] = lines.get(book_id, 0) + quantity if mode == 'add' else quantity
+
+    db = get_db()
+    user_id = session['user_id']
+    placeholders = ', '.join('?' for _ in lines)
+    known = {row['book_id'] for row in db.execute(
+        f'SELECT book_id FROM books WHERE book_id IN ({placeholders})', list(lines))}
+    missing = sorted(set(lines) - known)
+    if missing:
+        return jsonify({'status': 'error', 'message': 'Books not found.', 'book_ids': missing}), 404
+
+    with db:
+        db.execute(OPEN_CART, (user_id, next(iter(lines))))
+        cart_id = db.execute("SELECT cart_id FROM cart WHERE buyer_id = ? AND status = 'open'",
+                             (user_id,)).fetchone()['cart_id']
+        upsert = SET_CART_ITEM if mode == 'set' else UPSERT_CART_ITEM
+        db.executemany(upsert, [(cart_id, book_id, qty) for book_id, qty in lines.items() if qty > 0])
+        db.executemany('DELETE FROM cartitems WHERE cart_id = ? AND book_id = ?',
+                       [(cart_id, book_id) for book_id, qty in lines.items() if qty == 0])
+
+    cart_lines = db.execute('SELECT book_id, quantity FROM cartitems WHERE cart_id = ? ORDER BY cart_item_id',
+                            (cart_id,)).fetchall()
+    return jsonify({'status': 'success', 'data': {
+        'cart_id': cart_id,
+        'items': [{'book_id': line['book_id'], 'quantity': line['quantity']} for line in cart_lines],
+    }})
+
 
 @app.route('/cart')
 def cart():
@@ -543,7 +1146,7 @@ def cart():
             WHERE c.buyer_id = ? AND c.status = "open"
         ''', (session['user_id'],))
         cart_items = cur.fetchall()
-        return render_template('customer/cart.html', cart_items=cart_items, format_currency=format_currency)
+        return render_template('customer/cart.html', cart_items=cart_items)
     except Exception as e:
         flash(f'An error occurred: {e}', 'danger')
         return redirect(url_for('index'))
@@ -567,6 +1170,59 @@ def clear_cart():
 
     return redirect(url_for('cart'))
 
+class StockShortage(Exception):
+    def __init__(self, items):
+        super().__init__('Insufficient stock')
+        self.items = items
+
+
+def place_order(db, user_id, address):
+    """Turn the buyer's open cart into an order and reserve its stock in one write transaction.
+
+    Raises StockShortage, with one entry per short line, without writing anything if any book
+    lacks stock. Returns the new order_id, or None when the cart is empty.
+    """
+    with immediate_transaction(db):
+        lines = db.execute('''
+            SELECT c.cart_id, c.book_id, c.quantity, b.book_name, b.shop_id, b.price, IFNULL(b.stock, 0) AS stock
+            FROM cartitems c
+            JOIN books b ON c.book_id = b.book_id
+            JOIN shop sh ON sh.shop_id = b.shop_id
+            WHERE c.cart_id = (SELECT cart_id FROM cart WHERE buyer_id = ? AND status = 'open')
+        ''', (user_id,)).fetchall()
+        if not lines:
+            return None
+
+        shortages = [{'book_id': line['book_id'], 'book_name': line['book_name'],
+                      'requested': line['quantity'], 'available': line['stock']}
+                     for line in lines if line['stock'] < line['quantity']]
+        if shortages:
+            raise StockShortage(shortages)
+
+        cart_id = lines[0]['cart_id']
+        total_price = sum(line['price'] * line['quantity'] for line in lines)
+        platform_fee = total_price * 0.05
+        cur = db.execute(
+            'INSERT INTO orders (cart_id, buyer_id, subtotal, total, status, delivery_address, order_date) VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)',
+            (cart_id, user_id, total_price, total_price + platform_fee, 'initiated', address))
+        order_id = cur.lastrowid
+
+        db.executemany(
+            'INSERT INTO orderitems (order_id, book_id, shop_id, quantity, price, total_price) VALUES (?, ?, ?, ?, ?, ?)',
+            [(order_id, line['book_id'], line['shop_id'], line['quantity'], line['price'],
+              line['quantity'] * line['price']) for line in lines])
+
+        # The stock guard is redundant under the write lock but keeps the decrement safe on its own.
+        reserved = db.executemany('UPDATE books SET stock = stock - ? WHERE book_id = ? AND stock >= ?',
+                                  [(line['quantity'], line['book_id'], line['quantity']) for line in lines]).rowcount
+        if reserved != len(lines):
+            raise StockShortage([{'book_id': line['book_id'], 'book_name': line['book_name'],
+                                  'requested': line['quantity'], 'available': line['stock']} for line in lines])
+
+        db.execute('UPDATE cart SET status = ? WHERE cart_id = ?', ('completed', cart_id))
+    return order_id
+
+
 @app.route('/checkout', methods=['GET', 'POST'])
 def checkout():
     if 'user_id' not in session:
@@ -594,40 +1250,21 @@ def checkout():
             return redirect(url_for('index'))
 
         # Get the payment methods
-        cur = db.execute('SELECT method_id, method_name FROM paymentmethods')
-        payment_methods = cur.fetchall()
+        payment_methods = get_payment_methods()
 
         if request.method == 'POST':
-            # Create a new order
-            total_price = sum(item['price'] * item['quantity'] for item in cart_items)
             address = request.form.get('address')  # Collect delivery address
+            try:
+                order_id = place_order(db, user_id, address)
+            except StockShortage as e:
+                details = '; '.join(f"{item['book_name']} (requested {item['requested']}, available {item['available']})"
+                                    for item in e.items)
+                flash(f'Not enough stock for: {details}. Please update your cart.', 'danger')
+                return redirect(url_for('cart'))
 
-            cur = db.cursor()  # Use a cursor object to execute the insert command
-
-            # Retrieve the cart_id from the cart_items
-            cart_id = cart_items[0]['cart_id'] if cart_items else 0
-
-            # Calculate the platform fee
-            platform_fee = total_price * 0.05
-            total_price_with_fee = total_price + platform_fee
-
-            cur.execute(
-                'INSERT INTO orders (cart_id, buyer_id, subtotal, total, status, delivery_address, order_date) VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)',
-                (cart_id, user_id, total_price, total_price_with_fee, 'initiated', address))
-            order_id = cur.lastrowid  # Get the ID of the new order
-
-            for item in cart_items:
-                cur.execute(
-                    'INSERT INTO orderitems (order_id, book_id, shop_id, quantity, price, total_price) VALUES (?, ?, ?, ?, ?, ?)',
-                    (order_id, item['book_id'], item['shop_id'], item['quantity'], item['individual_price'],
-                     item['total_price']))
-
-            db.commit()
-
-            # Update cart status
-            cur.execute('UPDATE cart SET status = ? WHERE cart_id = ?', ('completed', cart_id))
-            db.commit()
-            cur.close()  # Close the cursor
+            if order_id is None:
+                flash('Your cart is empty.', 'warning')
+                return redirect(url_for('index'))
 
             flash('Your order has been placed successfully. Please proceed with the payment.', 'success')
             return redirect(url_for('payment', order_id=order_id))
@@ -637,8 +1274,7 @@ def checkout():
         total_with_fee = total + platform_fee
 
         return render_template('customer/checkout.html', cart=cart_items, total=total, platform_fee=platform_fee,
-                               total_with_fee=total_with_fee, payment_methods=payment_methods,
-                               format_currency=format_currency)
+                               total_with_fee=total_with_fee, payment_methods=payment_methods)
 
     except sqlite3.Error as e:
         app.logger.error('Database error occurred: %s', e)
@@ -653,29 +1289,11 @@ def checkout():
 
 
 def process_payment(order_id, method_id, amount):
-    payment_url = "http://127.0.0.1:5001/process_payment"
-    payload = json.dumps({
+    response = payment_client.post('/process_payment', json={
         "method_id": method_id,
         "order_id": order_id,
         "amount": amount
     })
-    headers = {
-        'Content-Type': 'application/json'
-    }
-    response = requests.post(payment_url, headers=headers, data=payload)
-    return response.json()
-
-
-def create_shipment(order_id, address):
-    shipment_url = "http://127.0.0.1:5002/create_shipment"
-    payload = json.dumps({
-        "order_id": order_id,
-        "address": address
-    })
-    headers = {
-        'Content-Type': 'application/json'
-    }
-    response = requests.post(shipment_url, headers=headers, data=payload)
     return response.json()
 
 
@@ -690,50 +1308,440 @@ def payment(order_id):
     # Fetch order details
     order = db.execute('SELECT * FROM orders WHERE order_id = ?', (order_id,)).fetchone()
 
+    if order is None or order['buyer_id'] != session['user_id']:
+        flash('Order not found.', 'danger')
+        return redirect(url_for('buyer_index'))
+
     if request.method == 'POST':
-        method_id = request.form.get('method')
+        # The form carries a per-render key; API clients may send an Idempotency-Key header instead.
+        key = request.headers.get('Idempotency-Key') or request.form.get('idempotency_key')
+        if key:
+            key = f"{session['user_id']}:{key}"
+            previous = payment_idempotency.begin(key)
+            if previous is IN_PROGRESS:
+                return redirect(url_for('payment_processing', order_id=order_id))
+            if previous is not None:
+                return redirect(previous[1]['location'])
+            try:
+                response = submit_payment(db, order, request.form.get('method', type=int))
+            except Exception:
+                payment_idempotency.release(key)
+                raise
+            payment_idempotency.complete(key, response.status_code, {'location': response.location})
+            return response
+        return submit_payment(db, order, request.form.get('method', type=int))
+
+    # Fetch available payment methods
+    methods = get_payment_methods()
+    return render_template('customer/payment.html', order=order, methods=methods,
+                           idempotency_key=uuid.uuid4().hex)
+
+
+def submit_payment(db, order, method_id):
+    """Queue a payment job for the order and return the redirect to send the buyer to."""
+    order_id = order['order_id']
+    if method_id not in {m['method_id'] for m in get_payment_methods()}:
+        flash('Please choose a valid payment method.', 'danger')
+        return redirect(url_for('payment', order_id=order_id))
+    if order['status'] == 'paid':
+        flash('This order has already been paid.', 'info')
+        return redirect(url_for('buyer_index'))
+    if order['status'] == 'expired':
+        flash('This order has expired and its books were released. Please place a new order.', 'warning')
+        return redirect(url_for('buyer_index'))
+
+    # Queue the charge; a resubmission while a job is pending reuses that job. The status is
+    # checked again in the insert, so an order expired in the meantime gets no new job.
+    with db:
+        db.execute('''
+            INSERT INTO payment_jobs (order_id, method_id, run_after)
+            SELECT ?, ?, ? WHERE EXISTS (SELECT 1 FROM orders WHERE order_id = ? AND status != 'expired')
+            ON CONFLICT (order_id) WHERE status IN ('queued', 'running') DO NOTHING
+        ''', (order_id, method_id, time.time(), order_id))
+    payment_workers.notify()
+    return redirect(url_for('payment_processing', order_id=order_id))
+
+
+@app.route('/payment/<int:order_id>/processing')
+def payment_processing(order_id):
+    if 'user_id' not in session:
+        flash('You need to be logged in to make a payment.', 'warning')
+        return redirect(url_for('login'))
+
+    order = get_db().execute('SELECT order_id, total, status FROM orders WHERE order_id = ? AND buyer_id = ?',
+                             (order_id, session['user_id'])).fetchone()
+    if order is None:
+        flash('Order not found.', 'danger')
+        return redirect(url_for('buyer_index'))
+    return render_template('customer/payment_processing.html', order=order)
+
+
+@app.route('/payment/<int:order_id>/status')
+def payment_status(order_id):
+    if 'user_id' not in session:
+        return jsonify({'status': 'error', 'message': 'You need to be logged in.'}), 401
+
+    row = get_db().execute('''
+        SELECT orders.status AS order_status, payment_jobs.status AS job_status, payment_jobs.error
+        FROM orders
+        LEFT JOIN payment_jobs ON payment_jobs.job_id = (
+            SELECT MAX(job_id) FROM payment_jobs WHERE payment_jobs.order_id = orders.order_id)
+        WHERE orders.order_id = ? AND orders.buyer_id = ?
+    ''', (order_id, session['user_id'])).fetchone()
+    if row is None:
+        return jsonify({'status': 'error', 'message': 'Order not found.'}), 404
+    return jsonify({'status': 'success', 'data': dict(row)})
+
+
+def claim_payment_job(db):
+    """Lock the oldest runnable job, including running jobs whose worker stopped renewing the lock."""
+    now = time.time()
+    with db:
+        rows = db.execute('''
+            UPDATE payment_jobs
+            SET status = 'running', attempts = attempts + 1, locked_until = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE job_id = (
+                SELECT job_id FROM payment_jobs
+                WHERE (status = 'queued' AND run_after <= ?) OR (status = 'running' AND locked_until < ?)
+                ORDER BY job_id LIMIT 1
+            )
+            RETURNING job_id, order_id, method_id, attempts
+        ''', (now + app.config['PAYMENT_JOB_LOCK_SECONDS'], now, now)).fetchall()
+    return rows[0] if rows else None
+
+
+def finish_payment_job(db, job, status, error=None, declined=False):
+    with db:
+        db.execute('''
+            UPDATE payment_jobs SET status = ?, error = ?, declined = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE job_id = ?
+        ''', (status, error, int(declined), job['job_id']))
+
+
+def gateway_idempotency_key(db, job):
+    """The gateway Idempotency-Key for a job: one per order, moving on only after a definitive decline.
+
+    Every retry of a job, and every later job for the order after one that gave up without an
+    answer, reuses the key, so the gateway replays or finishes the original charge instead of
+    making a new one. A buyer retrying after a decline gets a fresh key.
+    """
+    declines = db.execute('SELECT COUNT(*) FROM payment_jobs WHERE order_id = ? AND declined = 1 AND job_id < ?',
+                          (job['order_id'], job['job_id'])).fetchone()[0]
+    return f"order-{job['order_id']}-attempt-{declines}"
+
+
+def retry_payment_job(db, job, error):
+    if job['attempts'] >= app.config['PAYMENT_JOB_MAX_ATTEMPTS']:
+        finish_payment_job(db, job, 'failed', error)
+        return
+    delay = random.uniform(0.5, 1.0) * min(60, 2 ** job['attempts'])
+    with db:
+        db.execute('''
+            UPDATE payment_jobs SET status = 'queued', run_after = ?, error = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE job_id = ?
+        ''', (time.time() + delay, error, job['job_id']))
+
+
+def charge_payment_job(db, job):
+    order = db.execute('SELECT order_id, total, status FROM orders WHERE order_id = ?', (job['order_id'],)).fetchone()
+    if order is None:
+        return finish_payment_job(db, job, 'failed', 'Order not found.')
+    if order['status'] == 'paid':
+        return finish_payment_job(db, job, 'succeeded')
+    if order['status'] == 'expired':
+        return finish_payment_job(db, job, 'failed', 'This order has expired.', declined=True)
+    method_name = {m['method_id']: m['method_name'] for m in get_payment_methods()}.get(job['method_id'])
+    if method_name is None:
+        # Never sent to the gateway, so the order's next charge may use a fresh key.
+        return finish_payment_job(db, job, 'failed', 'Invalid payment method.', declined=True)
+
+    data = {
+        "amount": order['total'],
+        "method_id": job['method_id'],
+        "method_name": method_name,
+        "order_id": order['order_id']
+    }
+    try:
+        response = payment_client.post('/process_payment', json=data, idempotent=True,
+                                       headers={'Idempotency-Key': gateway_idempotency_key(db, job)})
+        response_data = response.json()
+    except (requests.RequestException, ValueError) as e:
+        app.logger.warning('Payment job %s: gateway call failed: %s', job['job_id'], e)
+        return retry_payment_job(db, job, 'Payment gateway unavailable.')
+
+    if response.status_code == 200 and response_data.get('status') == 'success':
+        with db:
+            db.execute('''
+                INSERT INTO payments (method_id, order_id, transaction_id, payment_date, payment_status, payment_total)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP, ?, ?)
+                ON CONFLICT (transaction_id) WHERE transaction_id IS NOT NULL DO NOTHING
+            ''', (job['method_id'], order['order_id'], response_data['data']['transaction_id'],
+                 response_data['data']['payment_status'], order['total']))
+            db.execute("UPDATE orders SET status = 'paid' WHERE order_id = ? AND status != 'paid'", (order['order_id'],))
+            db.execute('''
+                UPDATE payment_jobs SET status = 'succeeded', transaction_id = ?, error = NULL,
+                                        updated_at = CURRENT_TIMESTAMP
+                WHERE job_id = ?
+            ''', (response_data['data']['transaction_id'], job['job_id']))
+    elif response.status_code == 409:
+        # An earlier request with this key is still running at the gateway; ask again later for its outcome.
+        retry_payment_job(db, job, 'Payment is still being processed by the gateway.')
+    elif response.status_code >= 500 or response.status_code == 429:
+        retry_payment_job(db, job, f'Payment gateway error (HTTP {response.status_code}).')
+    else:
+        finish_payment_job(db, job, 'failed', response_data.get('message') or 'Payment declined by the gateway.',
+                           declined=True)
+
+
+def run_next_payment_job():
+    with app.app_context():
+        db = get_db()
+        job = claim_payment_job(db)
+        if job is None:
+            return False
+        charge_payment_job(db, job)
+        return True
+
+
+payment_workers = WorkerPool('payment', run_next_payment_job, threads=app.config['PAYMENT_WORKERS'],
+                             poll_interval=app.config['PAYMENT_WORKER_POLL_INTERVAL'])
+
+
+def expire_unpaid_orders():
+    """Expire orders left unpaid for PENDING_ORDER_TTL seconds and put their reserved stock back.
 
-        # Retrieve method_name for method_id
-        method_name = db.execute('SELECT method_name FROM paymentmethods WHERE method_id = ?', (method_id,)).fetchone()[
-            'method_name']
+    The status change and the restock happen in one write transaction. Orders with a queued or
+    running payment job are skipped, and so are orders whose last charge gave up without an
+    answer from the gateway (failed but not declined): that charge may still have gone through,
+    so they are left for reconciliation. Returns True when a batch was expired.
+    """
+    with app.app_context():
+        db = get_db()
+        with immediate_transaction(db):
+            order_ids = [row['order_id'] for row in db.execute('''
+                UPDATE orders SET status = 'expired'
+                WHERE order_id IN (
+                    SELECT order_id FROM orders
+                    WHERE status = 'initiated' AND order_date < datetime('now', ?)
+                      AND NOT EXISTS (
+                          SELECT 1 FROM payment_jobs
+                          WHERE payment_jobs.order_id = orders.order_id
+                            AND (status IN ('queued', 'running') OR (status = 'failed' AND declined = 0)))
+                    ORDER BY order_id LIMIT ?)
+                RETURNING order_id
+            ''', (f"-{app.config['PENDING_ORDER_TTL']} seconds", app.config['ORDER_EXPIRY_BATCH'])).fetchall()]
+            if not order_ids:
+                return False
+            book_ids = [row['book_id'] for row in db.execute('''
+                UPDATE books SET stock = IFNULL(stock, 0) + (
+                    SELECT SUM(quantity) FROM orderitems
+                    WHERE orderitems.book_id = books.book_id AND order_id IN (SELECT value FROM json_each(?)))
+                WHERE book_id IN (SELECT book_id FROM orderitems WHERE order_id IN (SELECT value FROM json_each(?)))
+                RETURNING book_id
+            ''', (json.dumps(order_ids), json.dumps(order_ids))).fetchall()]
+        for book_id in book_ids:
+            invalidate_book(book_id)
+        app.logger.info('Expired %d unpaid orders', len(order_ids))
+        return True
+
+
+order_expiry = WorkerPool('order-expiry', expire_unpaid_orders, poll_interval=app.config['ORDER_EXPIRY_INTERVAL'])
+
+
+def claim_shipment_batch(db):
+    """Lock the oldest ready outbox entries, including sending ones whose dispatcher stopped renewing the lock."""
+    now = time.time()
+    with db:
+        return db.execute('''
+            UPDATE shipment_outbox
+            SET status = 'sending', attempts = attempts + 1, locked_until = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE outbox_id IN (
+                SELECT outbox_id FROM shipment_outbox
+                WHERE (status = 'pending' AND run_after <= ?) OR (status = 'sending' AND locked_until < ?)
+                ORDER BY outbox_id LIMIT ?
+            )
+            RETURNING outbox_id, order_id, shipment_service, attempts
+        ''', (now + app.config['SHIPMENT_DISPATCH_LOCK_SECONDS'], now, now,
+              app.config['SHIPMENT_DISPATCH_BATCH'])).fetchall()
+
+
+def retry_shipments(db, entries, error):
+    """Put entries back with exponential backoff, or dead-letter those out of attempts."""
+    now = time.time()
+    with db:
+        for entry in entries:
+            if entry['attempts'] >= app.config['SHIPMENT_DISPATCH_MAX_ATTEMPTS']:
+                db.execute('''
+                    UPDATE shipment_outbox SET status = 'dead', error = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE outbox_id = ?
+                ''', (error, entry['outbox_id']))
+                app.logger.error('Shipment outbox %s dead-lettered: %s', entry['outbox_id'], error)
+            else:
+                delay = random.uniform(0.5, 1.0) * min(300, 2 ** entry['attempts'])
+                db.execute('''
+                    UPDATE shipment_outbox SET status = 'pending', run_after = ?, error = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE outbox_id = ?
+                ''', (now + delay, error, entry['outbox_id']))
 
-        # Define payment gateway API URL
-        payment_url = 'http://localhost:5001/process_payment'
-        data = {
-            "amount": order['total'],
-            "method_id": method_id,
-            "method_name": method_name,
-            "order_id": order_id
-        }
+
+def dispatch_shipments():
+    """Send the next batch of the shipment outbox to the carrier; returns True if a batch was sent."""
+    with app.app_context():
+        db = get_db()
+        entries = claim_shipment_batch(db)
+        if not entries:
+            return False
 
         try:
-            response = requests.post(payment_url, json=data)
-            try:
-                response_data = response.json()
-                if response.status_code == 200 and response_data['status'] == 'success':
-                    transaction_id = response_data['data']['transaction_id']
-                    payment_status = response_data['data']['payment_status']
-                    payment_total = order['total']  # Retrieve payment total from order
-
-                    # Insert payment details
-                    db.execute(
-                        'INSERT INTO payments (method_id, order_id, transaction_id, payment_date, payment_status, payment_total) VALUES (?, ?, ?, CURRENT_TIMESTAMP, ?, ?)',
-                        (method_id, order_id, transaction_id, payment_status, payment_total))
-                    db.execute('UPDATE orders SET status = ? WHERE order_id = ?', ('paid', order_id))
-                    db.commit()
-                    flash('Payment successful!', 'success')
+            # The carrier returns the existing tracking number for an order it already shipped, so resending is safe.
+            response = shipment_client.post('/initiate_shipments', idempotent=True, json={'shipments': [
+                {'order_id': entry['order_id'], 'shipment_service': entry['shipment_service'] or 'default_service'}
+                for entry in entries
+            ]})
+            body = response.json()
+        except (requests.RequestException, ValueError) as e:
+            app.logger.warning('Shipment dispatch: carrier call failed: %s', e)
+            retry_shipments(db, entries, 'Shipment service unavailable.')
+            return True
+        if response.status_code >= 500 or response.status_code == 429:
+            retry_shipments(db, entries, f'Shipment service error (HTTP {response.status_code}).')
+            return True
+        if response.status_code >= 400:
+            message = body.get('message') or f'Rejected by the shipment service (HTTP {response.status_code}).'
+            with db:
+                db.executemany('''
+                    UPDATE shipment_outbox SET status = 'dead', error = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE outbox_id = ?
+                ''', [(message, entry['outbox_id']) for entry in entries])
+            return True
+
+        results = body.get('data') or []
+        with immediate_transaction(db):
+            for entry, result in zip(entries, results):
+                if result.get('status') == 'success':
+                    db.execute('''
+                        INSERT INTO shipment (order_id, tracking_no, shipment_date, status, shipment_service)
+                        VALUES (?, ?, CURRENT_TIMESTAMP, 'Shipped', ?)
+                        ON CONFLICT (tracking_no) DO NOTHING
+                    ''', (entry['order_id'], result['tracking_no'], result.get('shipment_service')))
+                    db.execute('''
+                        UPDATE shipment_outbox
+                        SET status = 'sent', tracking_no = ?, error = NULL, updated_at = CURRENT_TIMESTAMP
+                        WHERE outbox_id = ?
+                    ''', (result['tracking_no'], entry['outbox_id']))
                 else:
-                    flash('Payment declined by the gateway.', 'danger')
-            except requests.exceptions.JSONDecodeError:
-                flash('Payment gateway returned an invalid response.', 'danger')
-        except requests.ConnectionError:
-            flash('Failed to connect to the payment gateway.', 'danger')
+                    db.execute('''
+                        UPDATE shipment_outbox SET status = 'dead', error = ?, updated_at = CURRENT_TIMESTAMP
+                        WHERE outbox_id = ?
+                    ''', (result.get('message') or 'Rejected by the shipment service.', entry['outbox_id']))
+        # Entries the carrier did not answer for go back into the queue.
+        if len(results) < len(entries):
+            retry_shipments(db, entries[len(results):], 'No result from the shipment service.')
+        return True
 
-        return redirect(url_for('buyer_index'))
 
-    # Fetch available payment methods
-    methods = db.execute('SELECT * FROM paymentmethods').fetchall()
-    return render_template('customer/payment.html', order=order, methods=methods, format_currency=format_currency)
+shipment_dispatchers = WorkerPool('shipment-dispatch', dispatch_shipments,
+                                  threads=app.config['SHIPMENT_DISPATCH_WORKERS'],
+                                  poll_interval=app.config['SHIPMENT_DISPATCH_POLL_INTERVAL'])
+
+
+SHIPMENT_EVENTS_CONSUMER = 'app.shipment_events'
+
+# Bumped (under the condition) whenever carrier events are applied, so open SSE streams wake up.
+shipment_updates = threading.Condition()
+shipment_updates_seq = 0
+
+
+def consume_shipment_events():
+    """Apply the next batch of carrier events to local shipments; returns True when more are waiting."""
+    global shipment_updates_seq
+    with app.app_context():
+        db = get_db()
+        row = db.execute('SELECT position FROM event_cursors WHERE consumer = ?', (SHIPMENT_EVENTS_CONSUMER,)).fetchone()
+        position = row['position'] if row else 0
+        try:
+            response = shipment_client.get('/shipment_events', params={
+                'after': position, 'limit': app.config['SHIPMENT_EVENTS_BATCH']})
+            body = response.json()
+        except (requests.RequestException, ValueError) as e:
+            app.logger.warning('Shipment events: carrier feed unavailable: %s', e)
+            return False
+        events = body.get('data') if response.status_code == 200 else None
+        if not events:
+            return False
+
+        with immediate_transaction(db):
+            db.executemany('''
+                INSERT INTO shipment_events (event_id, tracking_no, order_id, status, occurred_at)
+                VALUES (:event_id, :tracking_no, :order_id, :status, :occurred_at)
+                ON CONFLICT (event_id) DO NOTHING
+            ''', events)
+            # Only the newest known event of a shipment may set its status, so a lagging batch never rewinds it.
+            db.executemany('''
+                UPDATE shipment
+                SET status = :status,
+                    received_date = CASE WHEN :status = 'Delivered' THEN IFNULL(received_date, :occurred_at)
+                                         ELSE received_date END
+                WHERE tracking_no = :tracking_no AND NOT EXISTS (
+                    SELECT 1 FROM shipment_events e WHERE e.tracking_no = :tracking_no AND e.event_id > :event_id)
+            ''', events)
+            db.execute('''
+                INSERT INTO event_cursors (consumer, position) VALUES (?, ?)
+                ON CONFLICT (consumer) DO UPDATE SET position = MAX(position, excluded.position)
+            ''', (SHIPMENT_EVENTS_CONSUMER, events[-1]['event_id']))
+
+        with shipment_updates:
+            shipment_updates_seq += 1
+            shipment_updates.notify_all()
+        return bool(body.get('has_more'))
+
+
+# One consumer thread per process: the cursor is shared, so more threads would only fetch the same batch.
+shipment_event_workers = WorkerPool('shipment-events', consume_shipment_events,
+                                    poll_interval=app.config['SHIPMENT_EVENTS_POLL_INTERVAL'])
+
+
+@app.before_request
+def start_background_workers():
+    if app.config['PAYMENT_WORKERS'] > 0:
+        payment_workers.start()
+    if app.config['SHIPMENT_DISPATCH_WORKERS'] > 0:
+        shipment_dispatchers.start()
+    if app.config['CONSUME_SHIPMENT_EVENTS']:
+        shipment_event_workers.start()
+    if app.config['ORDER_EXPIRY_INTERVAL'] > 0:
+        order_expiry.start()
+
+
+@app.cli.command('payment-worker')
+def payment_worker_command():
+    """Process queued payments in the foreground (use with PAYMENT_WORKERS=0 on web processes)."""
+    while True:
+        if not run_next_payment_job():
+            time.sleep(app.config['PAYMENT_WORKER_POLL_INTERVAL'])
+
+
+@app.cli.command('expire-orders')
+def expire_orders_command():
+    """Expire every unpaid order past PENDING_ORDER_TTL and restock its books."""
+    while expire_unpaid_orders():
+        pass
+
+
+@app.cli.command('shipment-dispatcher')
+def shipment_dispatcher_command():
+    """Drain the shipment outbox in the foreground (use with SHIPMENT_DISPATCH_WORKERS=0 on web processes)."""
+    while True:
+        if not dispatch_shipments():
+            time.sleep(app.config['SHIPMENT_DISPATCH_POLL_INTERVAL'])
+
+
+@app.cli.command('shipment-events')
+def shipment_events_command():
+    """Consume carrier shipment events in the foreground (use with CONSUME_SHIPMENT_EVENTS=false on web processes)."""
+    while True:
+        if not consume_shipment_events():
+            time.sleep(app.config['SHIPMENT_EVENTS_POLL_INTERVAL'])
 
 
 @app.route('/shop/manage_books', methods=['GET', 'POST'])
@@ -756,12 +1764,14 @@ def manage_books():
         books.category_id = categories.category_id
     WHERE 
         books.shop_id = ?
+    ORDER BY
+        books.book_id
     '''
 
-    cur = db.execute(query, (shop_id,))
-    books = cur.fetchall()
+    # The whole catalog of the shop is listed, so stream it straight off the cursor.
+    books = db.execute(query, (shop_id,))
 
-    return render_template('shop/manage_books.html', books=books, format_currency=format_currency)
+    return stream_page('shop/manage_books.html', books=books)
 
 
 @app.route('/shop/add_book', methods=['GET', 'POST'])
@@ -774,7 +1784,7 @@ def add_book():
     db = get_db()
 
     # Fetch categories for the category dropdown
-    categories = db.execute('SELECT * FROM categories').fetchall()
+    categories = get_categories()
     form.category_id.choices = [(c['category_id'], c['category_name']) for c in categories]
 
     if form.validate_on_submit():
@@ -786,7 +1796,11 @@ def add_book():
         stock = form.stock.data
         category_id = form.category_id.data
         shop_id = session.get('shop_id')
-        image_file = save_image(form.image.data)
+        try:
+            image_file = save_image(form.image.data)
+        except ImageTooLarge as e:
+            flash(str(e), 'danger')
+            return render_template('shop/add_book.html', form=form)
 
         try:
             db.execute('''
@@ -794,6 +1808,7 @@ def add_book():
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
             ''', (category_id, shop_id, book_name, isbn, author, desc, price, stock, image_file))
             db.commit()
+            invalidate_book()
             flash('Book added successfully!', 'success')
             return redirect(url_for('manage_books'))
         except Exception as e:
@@ -805,10 +1820,19 @@ def add_book():
 def save_image(file):
     if not file:
         return None
-    filename = secure_filename(file.filename)
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    file.save(filepath)
-    return filename
+    # Stored under its content hash, so identical uploads share a file and names never clash.
+    extension = secure_filename(file.filename).rsplit('.', 1)[-1].lower()
+    return image_pipeline.save(file, 'jpg' if extension == 'jpeg' else extension)
+
+
+@app.cli.command('render-images')
+def render_images_command():
+    """Generate missing thumbnail/card/detail variants for every book cover."""
+    rows = get_db().execute('SELECT DISTINCT img_url FROM books WHERE img_url IS NOT NULL').fetchall()
+    futures = [image_pipeline.render(row['img_url']) for row in rows
+               if os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], row['img_url']))]
+    image_pipeline.shutdown()
+    print(f'Rendered variants for {len([f for f in futures if f is not None and not f.exception()])} images')
 
 
 @app.route('/shop/edit_book/<int:book_id>', methods=['GET', 'POST'])
@@ -821,7 +1845,7 @@ def edit_book(book_id):
     form = BookForm()
 
     # Fetch categories for the category dropdown
-    categories = db.execute('SELECT * FROM categories').fetchall()
+    categories = get_categories()
     form.category_id.choices = [(c['category_id'], c['category_name']) for c in categories]
 
     book = db.execute('SELECT * FROM books WHERE book_id = ? AND shop_id = ?', (book_id, session['shop_id'])).fetchone()
@@ -840,7 +1864,11 @@ def edit_book(book_id):
 
         # Check if a new image file is uploaded
         if form.image.data:
-            image_file = save_image(form.image.data)
+            try:
+                image_file = save_image(form.image.data)
+            except ImageTooLarge as e:
+                flash(str(e), 'danger')
+                return render_template('shop/edit_book.html', form=form, book_id=book_id)
         else:
             image_file = book['img_url']
 
@@ -851,6 +1879,7 @@ def edit_book(book_id):
                 WHERE book_id = ? AND shop_id = ?
             ''', (category_id, book_name, isbn, author, desc, price, stock, image_file, book_id, session['shop_id']))
             db.commit()
+            invalidate_book(book_id)
             flash('Book updated successfully!', 'success')
             return redirect(url_for('manage_books'))
         except Exception as e:
@@ -877,11 +1906,24 @@ def delete_book(book_id):
 
     db = get_db()
     try:
-        db.execute('DELETE FROM books WHERE book_id = ? AND shop_id = ?', (book_id, session['shop_id']))
-        db.commit()
+        with immediate_transaction(db):
+            owned = db.execute('SELECT 1 FROM books WHERE book_id = ? AND shop_id = ?',
+                               (book_id, session['shop_id'])).fetchone()
+            if owned:
+                # Cart lines and reviews go with the book; order history must stay, so a book that
+                # was ordered fails the foreign key check below and is kept.
+                db.execute('DELETE FROM cartitems WHERE book_id = ?', (book_id,))
+                db.execute('DELETE FROM reviews WHERE book_id = ?', (book_id,))
+                db.execute('DELETE FROM books WHERE book_id = ?', (book_id,))
+    except sqlite3.IntegrityError:
+        flash('This book has orders and cannot be deleted. Set its stock to 0 to stop selling it.', 'danger')
+        return redirect(url_for('manage_books'))
+
+    if owned:
+        invalidate_book(book_id)
         flash('Book deleted successfully!', 'success')
-    except Exception as e:
-        flash(f'An error occurred: {e}', 'danger')
+    else:
+        flash('Book not found!', 'danger')
 
     return redirect(url_for('manage_books'))
 
@@ -891,32 +1933,28 @@ def create_shipment_route(order_id):
         flash('You need to be logged in as a shop to perform this action.', 'warning')
         return redirect(url_for('shop_login'))
 
-    try:
-        db = get_db()
-        # Check if order exists
-        order = db.execute('SELECT * FROM orders WHERE order_id = ?', (order_id,)).fetchone()
-        if not order:
-            flash('Order not found!', 'danger')
-            return redirect(url_for('shop_order'))
-
-        # Call external shipment service (mock for now)
-        shipment_response = create_shipment(order_id, order['delivery_address'])  # Replace with actual logic
-        if shipment_response.get('status') == 'success':
-            tracking_no = shipment_response['tracking_no']
-
-            # Insert shipment data into database
-            db.execute(
-                'INSERT INTO shipment (order_id, tracking_no, shipment_date, status, shipment_service) VALUES (?, ?, CURRENT_TIMESTAMP, ?, ?)',
-                (order_id, tracking_no, 'in shipping', shipment_response['shipment_service'])
-            )
-            db.commit()
-            flash('Shipment created successfully!', 'success')
-        else:
-            flash('Failed to create shipment.', 'danger')
-
-    except Exception as e:
-        db.rollback()
-        flash(f'An error occurred: {e}', 'danger')
+    db = get_db()
+    # Check the order exists and contains this shop's books
+    order = db.execute('''
+        SELECT order_id FROM orders
+        WHERE order_id = ? AND EXISTS (
+            SELECT 1 FROM orderitems WHERE orderitems.order_id = orders.order_id AND orderitems.shop_id = ?)
+    ''', (order_id, session.get('shop_id'))).fetchone()
+    if not order:
+        flash('Order not found!', 'danger')
+        return redirect(url_for('shop_order'))
+
+    # Queue the shipment; the dispatcher sends it to the carrier and records the tracking number.
+    with db:
+        queued = db.execute('''
+            INSERT INTO shipment_outbox (order_id, shipment_service) VALUES (?, ?)
+            ON CONFLICT (order_id) WHERE status IN ('pending', 'sending', 'sent') DO NOTHING
+        ''', (order_id, request.form.get('shipment_service'))).rowcount
+    if queued:
+        shipment_dispatchers.notify()
+        flash('Shipment requested. The tracking number will appear once the carrier confirms it.', 'success')
+    else:
+        flash('A shipment has already been requested for this order.', 'info')
 
     return redirect(url_for('detail_order', order_id=order_id))
 
@@ -948,7 +1986,7 @@ def view_shipments():
 def buyer_view_shipments():
     if session.get('role') != 'buyer':
         flash('You need to be logged in as a buyer to access this page.', 'warning')
-        return redirect(url_for('buyer_login'))
+        return redirect(url_for('login'))
 
     try:
         db = get_db()
@@ -957,9 +1995,10 @@ def buyer_view_shipments():
             FROM shipment s
             JOIN orders o ON s.order_id = o.order_id
             WHERE o.buyer_id = ?
-        ''', (session.get('buyer_id'),)).fetchall()
+            ORDER BY s.shipment_id DESC
+        ''', (session.get('user_id'),)).fetchall()
 
-        return render_template('buyer/view_shipments.html', shipments=shipments)
+        return render_template('customer/view_shipments.html', shipments=shipments)
 
     except Exception as e:
         flash(f'An error occurred: {e}', 'danger')
@@ -967,29 +2006,77 @@ def buyer_view_shipments():
     return redirect(url_for('buyer_index'))
 
 
-@app.route('/buyer/track_shipment/<int:tracking_no>')
+def buyer_shipment(db, tracking_no):
+    return db.execute('''
+        SELECT s.*, o.order_date, o.delivery_address
+        FROM shipment s
+        JOIN orders o ON s.order_id = o.order_id
+        WHERE s.tracking_no = ? AND o.buyer_id = ?
+    ''', (tracking_no, session.get('user_id'))).fetchone()
+
+
+def shipment_events_after(db, tracking_no, after=0):
+    return db.execute('''
+        SELECT event_id, status, occurred_at FROM shipment_events
+        WHERE tracking_no = ? AND event_id > ? ORDER BY event_id
+    ''', (tracking_no, after)).fetchall()
+
+
+@app.route('/buyer/track_shipment/<tracking_no>')
 def track_shipment(tracking_no):
     if session.get('role') != 'buyer':
         flash('You need to be logged in as a buyer to perform this action.', 'warning')
-        return redirect(url_for('buyer_login'))
+        return redirect(url_for('login'))
 
     try:
         db = get_db()
-        shipment = db.execute('SELECT * FROM shipment WHERE tracking_no = ?', (tracking_no,)).fetchone()
+        shipment = buyer_shipment(db, tracking_no)
 
         if not shipment:
             flash('Shipment not found!', 'danger')
             return redirect(url_for('buyer_view_shipments'))
 
-        # Simulate external API lookup for shipment tracking
-        tracking_info = get_tracking_info(tracking_no)
+        # Tracking reads the local copy kept current by the shipment event consumer.
+        events = shipment_events_after(db, tracking_no)
 
-        return render_template('buyer/track_shipment.html', shipment=shipment, tracking_info=tracking_info)
+        return render_template('customer/track_shipment.html', shipment=shipment, events=events)
 
     except Exception as e:
         flash(f'An error occurred: {e}', 'danger')
 
     return redirect(url_for('buyer_index'))
 
+
+@app.route('/buyer/track_shipment/<tracking_no>/events')
+def track_shipment_events(tracking_no):
+    """Server-sent events with every status change of one shipment, resuming after Last-Event-ID."""
+    if session.get('role') != 'buyer':
+        return jsonify({'status': 'error', 'message': 'You need to be logged in as a buyer.'}), 401
+    if buyer_shipment(get_db(), tracking_no) is None:
+        return jsonify({'status': 'error', 'message': 'Shipment not found.'}), 404
+    after = request.headers.get('Last-Event-ID', type=int) or request.args.get('after', 0, type=int)
+    keepalive = app.config['SSE_KEEPALIVE_SECONDS']
+    deadline = time.monotonic() + app.config['SSE_MAX_SECONDS']
+
+    def stream(after):
+        yield 'retry: 5000\n\n'
+        while time.monotonic() < deadline:
+            seen = shipment_updates_seq
+            # Borrow a connection per poll; a stream may stay open for minutes.
+            with db_pool().connection() as db:
+                events = shipment_events_after(db, tracking_no, after)
+            for event in events:
+                after = event['event_id']
+                yield f"id: {after}\nevent: status\ndata: {json.dumps(dict(event))}\n\n"
+            if events and events[-1]['status'] == 'Delivered':
+                return
+            with shipment_updates:
+                woken = shipment_updates.wait_for(lambda: shipment_updates_seq != seen, keepalive)
+            if not woken:
+                yield ': keepalive\n\n'
+
+    return Response(stream(after), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 if __name__ == '__main__':
     app.run(debug=app.config['DEBUG'])
@@ -0,0 +1,120 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+
+try:
+    import brotli
+except ImportError:  # brotli is optional: without it only gzip copies are built
+    brotli = None
+
+BUILD_DIR = 'build'
+MANIFEST = 'manifest.json'
+# Directories under static/ that are not fingerprinted: the build output itself and user uploads,
+# which are already stored under content-hash names.
+SKIP_DIRS = (BUILD_DIR, 'uploads')
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.txt', '.html', '.map')
+# Upload originals and their variants are named <32 hex digits>[-variant].<ext> by the image pipeline.
+HASHED_NAME = re.compile(r'(^|/)[0-9a-f]{32}(-\w+)?\.\w+$')
+
+
+def fingerprint(path, length=10):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:length]
+
+
+def _write_compressed(path, data):
+    # Keep a precompressed copy only when it is actually smaller.
+    encoded = gzip.compress(data, compresslevel=9, mtime=0)
+    if len(encoded) < len(data):
+        with open(path + '.gz', 'wb') as f:
+            f.write(encoded)
+    if brotli is not None:
+        encoded = brotli.compress(data, quality=11)
+        if len(encoded) < len(data):
+            with open(path + '.br', 'wb') as f:
+                f.write(encoded)
+
+
+def build_assets(static_dir):
+    """Copy every static file to static/build/ under a content-hashed name and write the manifest.
+
+    Text assets also get .gz (and .br, when brotli is installed) siblings. Files from earlier
+    builds are left in place so pages rendered before a rebuild keep working. Returns the
+    manifest, which maps each logical filename (as passed to url_for('static')) to its built filename.
+    """
+    build_dir = os.path.join(static_dir, BUILD_DIR)
+    os.makedirs(build_dir, exist_ok=True)
+
+    manifest = {}
+    for root, dirs, files in os.walk(static_dir):
+        rel_root = os.path.relpath(root, static_dir)
+        if rel_root == '.':
+            dirs[:] = [d for d in dirs if d not in SKIP_DIRS]
+        for name in files:
+            source = os.path.join(root, name)
+            logical = os.path.normpath(os.path.join(rel_root, name)).replace(os.sep, '/')
+            stem, ext = os.path.splitext(logical)
+            built = f'{BUILD_DIR}/{stem}.{fingerprint(source)}{ext}'
+            target = os.path.join(static_dir, built)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(source, target)
+            if ext.lower() in COMPRESSIBLE:
+                with open(source, 'rb') as f:
+                    _write_compressed(target, f.read())
+            manifest[logical] = built
+
+    # Swap the manifest in atomically; running apps pick it up on their next poll.
+    tmp = os.path.join(build_dir, MANIFEST + '.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp, os.path.join(build_dir, MANIFEST))
+    return manifest
+
+
+class AssetManifest:
+    """Maps static filenames to their fingerprinted build names.
+
+    The manifest file is re-checked at most once per `poll_interval` seconds, so a new build is
+    picked up without restarting the app.
+    """
+
+    def __init__(self, static_dir, poll_interval=2.0):
+        self.path = os.path.join(static_dir, BUILD_DIR, MANIFEST)
+        self.poll_interval = poll_interval
+        self._entries = {}
+        self._mtime = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.poll_interval:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            self._entries, self._mtime = {}, None
+            return
+        if mtime != self._mtime:
+            with self._lock:
+                with open(self.path, encoding='utf-8') as f:
+                    self._entries = json.load(f)
+                self._mtime = mtime
+
+    def lookup(self, filename):
+        self._load()
+        return self._entries.get(filename)
+
+
+def is_immutable(filename):
+    """True for files whose name carries their content hash, so they can be cached forever."""
+    return filename.startswith(BUILD_DIR + '/') or bool(HASHED_NAME.search(filename))
@@ -0,0 +1,152 @@
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUCache:
+    """A thread-safe LRU cache whose entries also expire `ttl` seconds after being stored."""
+
+    def __init__(self, maxsize=1024, ttl=300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+
+def _next_version(current):
+    # Versions double as millisecond timestamps so they can also serve as Last-Modified values.
+    return max(current + 1, int(time.time() * 1000))
+
+
+class LocalVersions:
+    """Namespace version counters for a single process."""
+
+    def __init__(self):
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def version(self, namespace):
+        return self._versions.get(namespace, 0)
+
+    def bump(self, namespace):
+        with self._lock:
+            self._versions[namespace] = _next_version(self._versions.get(namespace, 0))
+            return self._versions[namespace]
+
+
+class SQLiteVersions:
+    """Namespace version counters stored in the cache_versions table, shared by every worker process.
+
+    A worker re-reads a namespace's version at most once per `poll_interval` seconds, so an
+    invalidation made by another process becomes visible within that window. Only the
+    `maxsize` most recently used namespaces are remembered between reads. Rows are only
+    written by `bump`; a namespace that was never invalidated reads as version 0.
+    """
+
+    def __init__(self, pool, poll_interval=1.0, maxsize=4096):
+        self.pool = pool
+        self.poll_interval = poll_interval
+        self._seen = LRUCache(maxsize=maxsize, ttl=poll_interval)
+
+    def version(self, namespace):
+        version = self._seen.get(namespace)
+        if version is not None:
+            return version
+        with self.pool.connection() as db:
+            row = db.execute('SELECT version FROM cache_versions WHERE namespace = ?', (namespace,)).fetchone()
+        version = row['version'] if row else 0
+        self._seen.set(namespace, version)
+        return version
+
+    def bump(self, namespace):
+        with self.pool.connection() as db:
+            db.execute('''
+                INSERT INTO cache_versions (namespace, version) VALUES (?, ?)
+                ON CONFLICT (namespace) DO UPDATE SET version = MAX(version + 1, excluded.version)
+            ''', (namespace, _next_version(0)))
+            db.commit()
+            version = db.execute('SELECT version FROM cache_versions WHERE namespace = ?', (namespace,)).fetchone()[0]
+        self._seen.set(namespace, version)
+        return version
+
+
+class Cache:
+    """Read-through cache whose entries are grouped into namespaces that can be invalidated as a whole.
+
+    Each entry remembers the namespace version it was loaded under; bumping the version in the
+    backend makes every entry of that namespace stale, in this process and in any other process
+    sharing the backend.
+    """
+
+    def __init__(self, backend=None, maxsize=1024, ttl=300.0):
+        self.backend = backend or LocalVersions()
+        self.entries = LRUCache(maxsize, ttl)
+        self.stale = 0
+
+    def version(self, namespace):
+        return self.backend.version(namespace)
+
+    def get_or_load(self, namespace, key, loader):
+        version = self.backend.version(namespace)
+        entry = self.entries.get((namespace, key))
+        if entry is not None:
+            if entry[0] == version:
+                return entry[1]
+            self.stale += 1
+        value = loader()
+        self.entries.set((namespace, key), (version, value))
+        return value
+
+    def invalidate(self, *namespaces):
+        for namespace in namespaces:
+            self.backend.bump(namespace)
+
+    def stats(self):
+        return dict(self.entries.stats(), stale=self.stale)
@@ -3,5 +3,86 @@ import os
 
 class Config:
     SECRET_KEY = os.getenv('SECRET_KEY', 'default-secret-key')
+    # Stored hashes made with another method or a lower cost are upgraded on the next successful login.
+    PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'pbkdf2:sha256')
+    # pbkdf2 only; 0 uses werkzeug's current default.
+    PASSWORD_HASH_ITERATIONS = int(os.getenv('PASSWORD_HASH_ITERATIONS', '0'))
+    PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', '2'))
+    PASSWORD_HASH_QUEUE_DEPTH = int(os.getenv('PASSWORD_HASH_QUEUE_DEPTH', '32'))
+    PASSWORD_HASH_TIMEOUT = float(os.getenv('PASSWORD_HASH_TIMEOUT', '10'))
+    # Per account and client address; the per-address limit covers all accounts tried from it.
+    # Counted per worker process (see passwords.AttemptLimiter).
+    LOGIN_MAX_FAILURES_PER_ACCOUNT = int(os.getenv('LOGIN_MAX_FAILURES_PER_ACCOUNT', '5'))
+    LOGIN_MAX_FAILURES_PER_IP = int(os.getenv('LOGIN_MAX_FAILURES_PER_IP', '50'))
+    LOGIN_FAILURE_WINDOW = float(os.getenv('LOGIN_FAILURE_WINDOW', '900'))
+    # Per account from any address, refilled more slowly, so spreading guesses over many
+    # addresses does not multiply the per-account budget.
+    LOGIN_MAX_FAILURES_PER_ACCOUNT_GLOBAL = int(os.getenv('LOGIN_MAX_FAILURES_PER_ACCOUNT_GLOBAL', '20'))
+    LOGIN_ACCOUNT_GLOBAL_WINDOW = float(os.getenv('LOGIN_ACCOUNT_GLOBAL_WINDOW', '10800'))
     DATABASE = os.getenv('DATABASE', 'penta_book.db')
     DEBUG = os.getenv('DEBUG', 'false').lower() in ['true', '1', 't', 'y', 'yes']
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '8'))
+    AUTO_MIGRATE = os.getenv('AUTO_MIGRATE', 'true').lower() in ['true', '1', 't', 'y', 'yes']
+    CATALOG_PAGE_SIZE = int(os.getenv('CATALOG_PAGE_SIZE', '24'))
+    CATALOG_MAX_PAGE_SIZE = int(os.getenv('CATALOG_MAX_PAGE_SIZE', '100'))
+    ORDERS_PAGE_SIZE = int(os.getenv('ORDERS_PAGE_SIZE', '20'))
+    ORDERS_MAX_PAGE_SIZE = int(os.getenv('ORDERS_MAX_PAGE_SIZE', '100'))
+    ADMIN_PAGE_SIZE = int(os.getenv('ADMIN_PAGE_SIZE', '50'))
+    ADMIN_MAX_PAGE_SIZE = int(os.getenv('ADMIN_MAX_PAGE_SIZE', '200'))
+    ADMIN_BULK_MAX_IDS = int(os.getenv('ADMIN_BULK_MAX_IDS', '1000'))
+    CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'sqlite')
+    CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', '2048'))
+    CACHE_TTL = float(os.getenv('CACHE_TTL', '300'))
+    CACHE_VERSION_POLL_INTERVAL = float(os.getenv('CACHE_VERSION_POLL_INTERVAL', '1.0'))
+    CART_BULK_MAX_ITEMS = int(os.getenv('CART_BULK_MAX_ITEMS', '200'))
+    PAYMENT_SERVICE_URL = os.getenv('PAYMENT_SERVICE_URL', 'http://127.0.0.1:5001')
+    SHIPMENT_SERVICE_URL = os.getenv('SHIPMENT_SERVICE_URL', 'http://127.0.0.1:5002')
+    UPSTREAM_CONNECT_TIMEOUT = float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', '2'))
+    UPSTREAM_READ_TIMEOUT = float(os.getenv('UPSTREAM_READ_TIMEOUT', '5'))
+    UPSTREAM_RETRIES = int(os.getenv('UPSTREAM_RETRIES', '2'))
+    UPSTREAM_POOL_SIZE = int(os.getenv('UPSTREAM_POOL_SIZE', '10'))
+    UPSTREAM_FAILURE_THRESHOLD = int(os.getenv('UPSTREAM_FAILURE_THRESHOLD', '5'))
+    UPSTREAM_RESET_TIMEOUT = float(os.getenv('UPSTREAM_RESET_TIMEOUT', '30'))
+    PAYMENT_WORKERS = int(os.getenv('PAYMENT_WORKERS', '2'))
+    PAYMENT_WORKER_POLL_INTERVAL = float(os.getenv('PAYMENT_WORKER_POLL_INTERVAL', '1.0'))
+    PAYMENT_JOB_MAX_ATTEMPTS = int(os.getenv('PAYMENT_JOB_MAX_ATTEMPTS', '5'))
+    PAYMENT_JOB_LOCK_SECONDS = float(os.getenv('PAYMENT_JOB_LOCK_SECONDS', '60'))
+    # Unpaid orders older than this are expired and their reserved stock is released.
+    PENDING_ORDER_TTL = int(os.getenv('PENDING_ORDER_TTL', '3600'))
+    ORDER_EXPIRY_INTERVAL = float(os.getenv('ORDER_EXPIRY_INTERVAL', '60'))
+    ORDER_EXPIRY_BATCH = int(os.getenv('ORDER_EXPIRY_BATCH', '100'))
+    IDEMPOTENCY_TTL = float(os.getenv('IDEMPOTENCY_TTL', str(24 * 3600)))
+    # How long an unfinished request holds its idempotency key; covers the upstream timeouts and retries.
+    IDEMPOTENCY_LEASE_SECONDS = float(os.getenv('IDEMPOTENCY_LEASE_SECONDS', '30'))
+    IDEMPOTENCY_MAX_ENTRIES = int(os.getenv('IDEMPOTENCY_MAX_ENTRIES', '100000'))
+    GATEWAY_METHODS_TTL = float(os.getenv('GATEWAY_METHODS_TTL', '60'))
+    GATEWAY_BATCH_MAX_ITEMS = int(os.getenv('GATEWAY_BATCH_MAX_ITEMS', '1000'))
+    GATEWAY_HISTORY_BUFFER = int(os.getenv('GATEWAY_HISTORY_BUFFER', '1000'))
+    GATEWAY_HISTORY_PAGE_SIZE = int(os.getenv('GATEWAY_HISTORY_PAGE_SIZE', '50'))
+    GATEWAY_HISTORY_MAX_PAGE_SIZE = int(os.getenv('GATEWAY_HISTORY_MAX_PAGE_SIZE', '500'))
+    SHIPMENT_BATCH_MAX_ITEMS = int(os.getenv('SHIPMENT_BATCH_MAX_ITEMS', '1000'))
+    SHIPMENT_STAGE_SECONDS = float(os.getenv('SHIPMENT_STAGE_SECONDS', '60'))
+    SHIPMENT_ENGINE_INTERVAL = float(os.getenv('SHIPMENT_ENGINE_INTERVAL', '1.0'))
+    SHIPMENT_EVENTS_BATCH = int(os.getenv('SHIPMENT_EVENTS_BATCH', '500'))
+    SHIPMENT_DISPATCH_WORKERS = int(os.getenv('SHIPMENT_DISPATCH_WORKERS', '1'))
+    SHIPMENT_DISPATCH_POLL_INTERVAL = float(os.getenv('SHIPMENT_DISPATCH_POLL_INTERVAL', '1.0'))
+    SHIPMENT_DISPATCH_BATCH = int(os.getenv('SHIPMENT_DISPATCH_BATCH', '100'))
+    SHIPMENT_DISPATCH_MAX_ATTEMPTS = int(os.getenv('SHIPMENT_DISPATCH_MAX_ATTEMPTS', '8'))
+    SHIPMENT_DISPATCH_LOCK_SECONDS = float(os.getenv('SHIPMENT_DISPATCH_LOCK_SECONDS', '60'))
+    IMAGE_MAX_BYTES = int(os.getenv('IMAGE_MAX_BYTES', str(5 * 1024 * 1024)))
+    IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', '2'))
+    MAX_CONTENT_LENGTH = IMAGE_MAX_BYTES + 1024 * 1024
+    PAGE_CACHE_MAX_ENTRIES = int(os.getenv('PAGE_CACHE_MAX_ENTRIES', '512'))
+    PAGE_CACHE_TTL = float(os.getenv('PAGE_CACHE_TTL', '300'))
+    RELEASE_ID = os.getenv('RELEASE_ID', '')
+    # Compiled templates are kept here across restarts; defaults to <instance folder>/jinja_cache.
+    JINJA_CACHE_DIR = os.getenv('JINJA_CACHE_DIR', '')
+    STREAM_BUFFER_SIZE = int(os.getenv('STREAM_BUFFER_SIZE', '64'))
+    CONSUME_SHIPMENT_EVENTS = os.getenv('CONSUME_SHIPMENT_EVENTS', 'true').lower() in ['true', '1', 't', 'y', 'yes']
+    SHIPMENT_EVENTS_POLL_INTERVAL = float(os.getenv('SHIPMENT_EVENTS_POLL_INTERVAL', '2.0'))
+    SSE_KEEPALIVE_SECONDS = float(os.getenv('SSE_KEEPALIVE_SECONDS', '15'))
+    SSE_MAX_SECONDS = float(os.getenv('SSE_MAX_SECONDS', '300'))
+    # JSON objects of fault_injection settings for the mock services, e.g. '{"latency": "longtail", "latency_ms": 80}'
+    PAYMENT_FAULTS = os.getenv('PAYMENT_FAULTS', '')
+    SHIPMENT_FAULTS = os.getenv('SHIPMENT_FAULTS', '')
+    FAULTS_ADMIN_TOKEN = os.getenv('FAULTS_ADMIN_TOKEN')
@@ -0,0 +1,156 @@
+import json
+import math
+import random
+import threading
+import time
+
+from flask import jsonify, request
+
+LATENCY_MODES = ('none', 'fixed', 'normal', 'longtail')
+
+DEFAULTS = {
+    'latency': 'none',        # none | fixed | normal | longtail
+    'latency_ms': 0.0,        # fixed delay, mean (normal) or median (longtail)
+    'jitter_ms': 0.0,         # standard deviation for 'normal'
+    'tail_sigma': 1.0,        # log-space spread for 'longtail'; 1.0 puts p99 near 10x the median
+    'max_latency_ms': 30000.0,
+    'error_rate': 0.0,        # share of requests answered with error_status
+    'error_status': 503,
+    'timeout_rate': 0.0,      # share of requests that hang for timeout_ms and then return 504
+    'timeout_ms': 30000.0,
+    'throttle_rate': 0.0,     # share of requests rejected with 429
+    'rate_limit': 0.0,        # requests per second before 429s; 0 disables the token bucket
+    'burst': 10.0,
+    'retry_after': 1,
+}
+
+
+class FaultInjector:
+    """Degrades a mock service on purpose: adds latency, errors, hangs and 429 throttling.
+
+    Settings start from DEFAULTS overlaid with a JSON object (usually from an env var) and can be
+    changed at runtime through the `/admin/faults` endpoint that `install()` registers
+    (GET to read, PUT/PATCH a JSON object to update, DELETE to reset).
+    """
+
+    def __init__(self, settings=None, admin_token=None):
+        self.admin_token = admin_token
+        self._lock = threading.Lock()
+        self._settings = dict(DEFAULTS)
+        self._tokens = 0.0
+        self._refilled_at = time.monotonic()
+        self._stats = {'requests': 0, 'delayed': 0, 'errors': 0, 'timeouts': 0, 'throttled': 0}
+        self.update(settings or {})
+
+    @classmethod
+    def from_json(cls, text, admin_token=None):
+        return cls(json.loads(text) if text else {}, admin_token=admin_token)
+
+    def settings(self):
+        with self._lock:
+            return dict(self._settings)
+
+    def update(self, changes, replace=False):
+        unknown = set(changes) - set(DEFAULTS)
+        if unknown:
+            raise ValueError(f"Unknown fault settings: {', '.join(sorted(unknown))}")
+        merged = dict(DEFAULTS if replace else self.settings(), **changes)
+        if merged['latency'] not in LATENCY_MODES:
+            raise ValueError(f"latency must be one of {', '.join(LATENCY_MODES)}")
+        for name, default in DEFAULTS.items():
+            if name != 'latency':
+                merged[name] = type(default)(merged[name])
+        for name in ('error_rate', 'timeout_rate', 'throttle_rate'):
+            if not 0.0 <= merged[name] <= 1.0:
+                raise ValueError(f'{name} must be between 0 and 1')
+        with self._lock:
+            self._settings = merged
+            self._tokens = merged['burst']
+            self._refilled_at = time.monotonic()
+        return dict(merged)
+
+    def reset(self):
+        return self.update({}, replace=True)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def _rate_limited(self, settings):
+        if settings['rate_limit'] <= 0:
+            return False
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(settings['burst'], self._tokens + (now - self._refilled_at) * settings['rate_limit'])
+            self._refilled_at = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return False
+            return True
+
+    def latency_ms(self, settings):
+        mode = settings['latency']
+        if mode == 'fixed':
+            delay = settings['latency_ms']
+        elif mode == 'normal':
+            delay = random.gauss(settings['latency_ms'], settings['jitter_ms'])
+        elif mode == 'longtail':
+            delay = random.lognormvariate(math.log(max(settings['latency_ms'], 0.001)), settings['tail_sigma'])
+        else:
+            delay = 0.0
+        return max(0.0, min(delay, settings['max_latency_ms']))
+
+    def inject(self):
+        """Apply the configured faults to the current request; returns a response to short-circuit it, or None."""
+        settings = self.settings()
+        self._count('requests')
+
+        if self._rate_limited(settings) or random.random() < settings['throttle_rate']:
+            self._count('throttled')
+            return (jsonify({'status': 'failed', 'message': 'Too many requests'}), 429,
+                    {'Retry-After': str(settings['retry_after'])})
+
+        delay = self.latency_ms(settings)
+        if delay > 0:
+            self._count('delayed')
+            time.sleep(delay / 1000)
+
+        if random.random() < settings['timeout_rate']:
+            self._count('timeouts')
+            time.sleep(settings['timeout_ms'] / 1000)
+            return jsonify({'status': 'failed', 'message': 'Upstream timed out'}), 504
+
+        if random.random() < settings['error_rate']:
+            self._count('errors')
+            return jsonify({'status': 'failed', 'message': 'Injected failure'}), settings['error_status']
+        return None
+
+    def install(self, app):
+        """Run `inject()` before every request of `app` and register its `/admin/faults` endpoint."""
+
+        @app.before_request
+        def inject_faults():
+            if request.endpoint != 'admin_faults':
+                return self.inject()
+
+        @app.route('/admin/faults', methods=['GET', 'PUT', 'PATCH', 'DELETE'], endpoint='admin_faults')
+        def admin_faults():
+            if self.admin_token and request.headers.get('X-Admin-Token') != self.admin_token:
+                return jsonify({'status': 'failed', 'message': 'Invalid admin token'}), 403
+            if request.method == 'DELETE':
+                return jsonify({'status': 'success', 'data': self.reset()})
+            if request.method in ('PUT', 'PATCH'):
+                changes = request.get_json(silent=True)
+                if not isinstance(changes, dict):
+                    return jsonify({'status': 'failed', 'message': 'Expected a JSON object'}), 400
+                try:
+                    self.update(changes, replace=request.method == 'PUT')
+                except (TypeError, ValueError) as e:
+                    return jsonify({'status': 'failed', 'message': str(e)}), 400
+            return jsonify({'status': 'success', 'data': self.settings(), 'stats': self.stats()})
+
+        return self
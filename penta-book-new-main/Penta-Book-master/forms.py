@@ -47,7 +47,7 @@ class BookForm(FlaskForm):
     price = FloatField('Price', validators=[DataRequired(), NumberRange(min=0)])
     stock = IntegerField('Stock', validators=[DataRequired(), NumberRange(min=0)])
     category_id = SelectField('Category', coerce=int, validators=[DataRequired()])
-    image = FileField('Book Cover Image', validators=[FileAllowed(['jpg', 'png', 'jpeg'], 'Images only!')])
+    image = FileField('Book Cover Image', validators=[FileAllowed(['jpg', 'png', 'jpeg', 'webp'], 'Images only!')])
     submit = SubmitField('Save')
 
 class ShopUpdateForm(FlaskForm):
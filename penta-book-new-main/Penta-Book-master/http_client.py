@@ -0,0 +1,146 @@
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+RETRY_STATUSES = frozenset([429, 502, 503, 504])
+
+
+class UpstreamUnavailable(requests.ConnectionError):
+    """Raised without making a request while an upstream's circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures and lets a single probe through
+    once `reset_timeout` seconds have passed; the probe's outcome closes or re-opens it."""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+
+class UpstreamClient:
+    """Keep-alive HTTP client for one upstream service.
+
+    Every request is bounded by connect/read timeouts. Idempotent requests (and any request
+    sent with idempotent=True) are retried on connection errors, timeouts and 429/502/503/504
+    responses with exponential backoff and full jitter. Failures feed a circuit breaker so a
+    dead upstream is failed fast instead of tying up request threads.
+    """
+
+    def __init__(self, name, base_url, connect_timeout=2.0, read_timeout=5.0, retries=2, backoff=0.1,
+                 max_backoff=2.0, pool_size=10, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._lock = threading.Lock()
+        self._stats = {'requests': 0, 'errors': 0, 'timeouts': 0, 'retries': 0, 'rejected': 0,
+                       'latency_ms_total': 0.0, 'latency_ms_max': 0.0}
+
+    def _count(self, **increments):
+        with self._lock:
+            for key, value in increments.items():
+                self._stats[key] += value
+
+    def _observe(self, elapsed_ms):
+        with self._lock:
+            self._stats['requests'] += 1
+            self._stats['latency_ms_total'] += elapsed_ms
+            self._stats['latency_ms_max'] = max(self._stats['latency_ms_max'], elapsed_ms)
+
+    def _sleep_before_retry(self, attempt, response=None):
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        if response is not None and response.headers.get('Retry-After', '').isdigit():
+            delay = max(delay, min(self.max_backoff, float(response.headers['Retry-After'])))
+        self._count(retries=1)
+        time.sleep(delay)
+
+    def request(self, method, path, idempotent=None, **kwargs):
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        attempts = 1 + (self.retries if idempotent else 0)
+        kwargs.setdefault('timeout', self.timeout)
+
+        for attempt in range(attempts):
+            last_attempt = attempt == attempts - 1
+            if not self.breaker.allow():
+                self._count(rejected=1)
+                raise UpstreamUnavailable(f'{self.name} upstream is unavailable (circuit open)')
+
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, self.base_url + path, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._observe((time.perf_counter() - started) * 1000)
+                self._count(errors=1, timeouts=int(isinstance(e, requests.Timeout)))
+                self.breaker.record_failure()
+                if last_attempt:
+                    raise
+                self._sleep_before_retry(attempt)
+                continue
+            except BaseException:
+                # Anything else still has to settle the breaker, or a failed half-open probe
+                # would leave it half open and rejecting every later call.
+                self.breaker.record_failure()
+                raise
+
+            self._observe((time.perf_counter() - started) * 1000)
+            if response.status_code >= 500:
+                self._count(errors=1)
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            if response.status_code in RETRY_STATUSES and not last_attempt:
+                response.close()  # hand the connection back to the pool before retrying
+                self._sleep_before_retry(attempt, response)
+                continue
+            return response
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['latency_ms_avg'] = stats['latency_ms_total'] / stats['requests'] if stats['requests'] else 0.0
+        stats['circuit'] = self.breaker.state
+        return stats
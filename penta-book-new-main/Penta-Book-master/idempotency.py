@@ -0,0 +1,80 @@
+import json
+import threading
+import time
+
+IN_PROGRESS = object()
+
+
+class IdempotencyStore:
+    """Remembers the first response produced for an idempotency key so replays can return it.
+
+    Usage: `begin(key)` returns None when the caller owns the key and must do the work, then
+    call `complete(key, status_code, body)` (or `release(key)` if the work failed before having
+    any effect). When the key was seen before, `begin` returns the stored (status_code, body),
+    or IN_PROGRESS while the first request is still running. A claim is only held for `lease`
+    seconds; a request that died without completing or releasing the key loses it to the next
+    `begin` after that. Entries expire after `ttl` seconds and at most `max_entries` are kept
+    per scope. The table comes from migrations 0015 and 0017.
+    """
+
+    def __init__(self, pool, scope, ttl=24 * 3600, lease=30.0, max_entries=100000, purge_every=500):
+        self.pool = pool
+        self.scope = scope
+        self.ttl = ttl
+        self.lease = lease
+        self.max_entries = max_entries
+        self.purge_every = purge_every
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def begin(self, key):
+        now = time.time()
+        with self.pool.connection() as db:
+            with db:
+                db.execute('DELETE FROM idempotency_keys WHERE scope = ? AND key = ? AND expires_at < ?',
+                           (self.scope, key, now))
+                claimed = db.execute('''
+                    INSERT INTO idempotency_keys (scope, key, created_at, expires_at, locked_until)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (scope, key) DO UPDATE SET
+                        created_at = excluded.created_at,
+                        expires_at = excluded.expires_at,
+                        locked_until = excluded.locked_until
+                    WHERE status_code IS NULL AND IFNULL(locked_until, 0) < ?
+                ''', (self.scope, key, now, now + self.ttl, now + self.lease, now)).rowcount
+            if claimed:
+                return None
+            row = db.execute('SELECT status_code, response FROM idempotency_keys WHERE scope = ? AND key = ?',
+                             (self.scope, key)).fetchone()
+        if row is None or row['status_code'] is None:
+            return IN_PROGRESS
+        return row['status_code'], json.loads(row['response'])
+
+    def complete(self, key, status_code, body):
+        with self.pool.connection() as db:
+            with db:
+                db.execute('''
+                    UPDATE idempotency_keys SET status_code = ?, response = ?, locked_until = NULL
+                    WHERE scope = ? AND key = ? AND status_code IS NULL
+                ''', (status_code, json.dumps(body), self.scope, key))
+        with self._lock:
+            self._writes += 1
+            due = self._writes % self.purge_every == 0
+        if due:
+            self.purge()
+
+    def release(self, key):
+        with self.pool.connection() as db:
+            with db:
+                db.execute('DELETE FROM idempotency_keys WHERE scope = ? AND key = ? AND status_code IS NULL',
+                           (self.scope, key))
+
+    def purge(self):
+        with self.pool.connection() as db:
+            with db:
+                db.execute('DELETE FROM idempotency_keys WHERE expires_at < ?', (time.time(),))
+                db.execute('''
+                    DELETE FROM idempotency_keys WHERE scope = ? AND created_at < (
+                        SELECT created_at FROM idempotency_keys WHERE scope = ?
+                        ORDER BY created_at DESC LIMIT 1 OFFSET ?)
+                ''', (self.scope, self.scope, self.max_entries - 1))
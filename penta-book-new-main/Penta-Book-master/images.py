@@ -0,0 +1,139 @@
+import hashlib
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional: without it uploads are stored but no variants are generated
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Bounding boxes (width, height) for each rendition; covers keep their aspect ratio inside the box.
+VARIANTS = {
+    'thumb': (160, 240),
+    'card': (320, 480),
+    'detail': (800, 1200),
+}
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+CHUNK_SIZE = 64 * 1024
+VARIANTS_DIR = 'variants'
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+def variant_name(filename, variant, fmt):
+    stem = os.path.splitext(filename)[0]
+    return f'{VARIANTS_DIR}/{stem}-{variant}.{"jpg" if fmt == "jpeg" else fmt}'
+
+
+def generate_variants(upload_dir, filename):
+    """Write every missing variant of an original upload. Runs in a worker process."""
+    with Image.open(os.path.join(upload_dir, filename)) as original:
+        original = ImageOps.exif_transpose(original)
+        if original.mode not in ('RGB', 'RGBA'):
+            original = original.convert('RGBA' if 'transparency' in original.info else 'RGB')
+        for variant, size in VARIANTS.items():
+            rendition = original.copy()
+            rendition.thumbnail(size, Image.LANCZOS)
+            for fmt, (pil_format, options) in FORMATS.items():
+                path = os.path.join(upload_dir, variant_name(filename, variant, fmt))
+                if os.path.exists(path):
+                    continue
+                image = rendition
+                if pil_format == 'JPEG' and image.mode == 'RGBA':
+                    image = Image.new('RGB', image.size, (255, 255, 255))
+                    image.paste(rendition, mask=rendition.getchannel('A'))
+                # Write next to the target and rename, so readers never see a half-written file.
+                fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+                with os.fdopen(fd, 'wb') as out:
+                    image.save(out, pil_format, **options)
+                os.replace(tmp, path)
+
+
+class ImagePipeline:
+    """Stores uploaded images under their content hash and renders sized WebP/JPEG variants off the request thread.
+
+    `save(file)` streams the upload to disk (rejecting it with ImageTooLarge past `max_bytes`),
+    keeps one copy per distinct content and returns the stored filename; variant generation is
+    queued on a process pool. `variant(filename, name, fmt)` returns the static path of a
+    generated variant, or None while it does not exist yet.
+    """
+
+    def __init__(self, upload_dir, max_bytes=5 * 1024 * 1024, workers=2):
+        self.upload_dir = upload_dir
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self._ready = set()
+        os.makedirs(os.path.join(upload_dir, VARIANTS_DIR), exist_ok=True)
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                # Same reason as passwords.PasswordHasher: never fork the threaded app process.
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def save(self, file, extension):
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp = tempfile.mkstemp(dir=self.upload_dir, suffix='.upload')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                while True:
+                    chunk = file.stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise ImageTooLarge(f'Images must be at most {self.max_bytes // (1024 * 1024)} MB.')
+                    digest.update(chunk)
+                    out.write(chunk)
+            filename = f'{digest.hexdigest()[:32]}.{extension}'
+            path = os.path.join(self.upload_dir, filename)
+            if os.path.exists(path):
+                os.remove(tmp)
+            else:
+                os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self.render(filename)
+        return filename
+
+    def render(self, filename):
+        if Image is None:
+            return None
+        future = self._pool().submit(generate_variants, self.upload_dir, filename)
+        future.add_done_callback(lambda f: f.exception() and logger.error(
+            'Generating variants for %s failed: %s', filename, f.exception()))
+        return future
+
+    def variant(self, filename, name, fmt='jpeg'):
+        if not filename:
+            return None
+        path = variant_name(filename, name, fmt)
+        if path not in self._ready:
+            if not os.path.exists(os.path.join(self.upload_dir, path)):
+                return None
+            self._ready.add(path)
+        return path
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
@@ -0,0 +1,72 @@
+import os
+import re
+import sqlite3
+import sys
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+MIGRATION_FILE = re.compile(r'^(\d+)_(\w+)\.sql$')
+
+
+def available_migrations():
+    migrations = []
+    for filename in os.listdir(MIGRATIONS_DIR):
+        match = MIGRATION_FILE.match(filename)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), os.path.join(MIGRATIONS_DIR, filename)))
+    return sorted(migrations)
+
+
+def current_version(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version    INTEGER PRIMARY KEY,
+            name       TEXT NOT NULL,
+            applied_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    db.commit()
+    return db.execute('SELECT IFNULL(MAX(version), 0) FROM schema_version').fetchone()[0]
+
+
+def upgrade(db, target=None):
+    """Apply every migration newer than the recorded schema version, each in its own transaction.
+
+    Safe to run from several processes at once: each migration starts with BEGIN IMMEDIATE and
+    first claims its schema_version row, so one that another process has just applied fails on
+    that insert before any of its statements run, and is skipped.
+    Returns the list of (version, name) pairs that were applied.
+    """
+    version = current_version(db)
+    applied = []
+    for number, name, path in available_migrations():
+        if number <= version or (target is not None and number > target):
+            continue
+        with open(path, encoding='utf-8') as f:
+            script = f.read()
+        try:
+            db.executescript(
+                'BEGIN IMMEDIATE;\n'
+                f"INSERT INTO schema_version (version, name) VALUES ({number}, '{name}');\n"
+                f'{script}\n;'
+                'COMMIT;'
+            )
+        except sqlite3.Error as e:
+            if db.in_transaction:
+                db.rollback()
+            if isinstance(e, sqlite3.IntegrityError) and current_version(db) >= number:
+                continue
+            raise RuntimeError(f'Migration {number:04d}_{name} failed: {e}') from e
+        applied.append((number, name))
+    return applied
+
+
+if __name__ == '__main__':
+    from config import Config
+
+    conn = sqlite3.connect(sys.argv[1] if len(sys.argv) > 1 else Config.DATABASE)
+    try:
+        for number, name in upgrade(conn):
+            print(f'Applied {number:04d}_{name}')
+        print(f'Schema version: {current_version(conn)}')
+    finally:
+        conn.close()
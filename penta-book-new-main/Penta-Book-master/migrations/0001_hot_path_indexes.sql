@@ -0,0 +1,15 @@
+-- Secondary indexes for the filters used by the dashboard, cart, checkout and tracking queries.
+CREATE INDEX IF NOT EXISTS idx_orderitems_shop_order ON orderitems (shop_id, order_id, quantity, total_price);
+CREATE INDEX IF NOT EXISTS idx_orderitems_order ON orderitems (order_id);
+CREATE INDEX IF NOT EXISTS idx_orders_status ON orders (status, order_id);
+CREATE INDEX IF NOT EXISTS idx_cart_buyer_status ON cart (buyer_id, status);
+CREATE INDEX IF NOT EXISTS idx_cartitems_cart_book ON cartitems (cart_id, book_id);
+CREATE INDEX IF NOT EXISTS idx_shipment_order ON shipment (order_id);
+CREATE INDEX IF NOT EXISTS idx_shipment_tracking_no ON shipment (tracking_no);
+CREATE INDEX IF NOT EXISTS idx_books_shop ON books (shop_id);
+
+-- Catalog sort orders (see CATALOG_SORTS in app.py); the expressions must match the queries exactly.
+CREATE INDEX IF NOT EXISTS idx_books_price ON books (IFNULL(price, 0), book_id);
+CREATE INDEX IF NOT EXISTS idx_books_name ON books (IFNULL(book_name, ''), book_id);
+
+ANALYZE;
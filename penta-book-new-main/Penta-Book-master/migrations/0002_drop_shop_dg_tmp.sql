@@ -0,0 +1,2 @@
+-- Leftover from an interrupted table rebuild of shop; nothing reads it.
+DROP TABLE IF EXISTS shop_dg_tmp;
@@ -0,0 +1,29 @@
+-- External-content FTS5 index over the searchable book columns. The triggers keep it in
+-- step with every INSERT/UPDATE/DELETE on books, so add_book, edit_book and delete_book
+-- need no search-specific code. Column weights for bm25: title, author, description, isbn.
+CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+    book_name, author, "desc", isbn,
+    content='books', content_rowid='book_id',
+    tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+);
+
+INSERT INTO books_fts(books_fts, rank) VALUES ('rank', 'bm25(10.0, 5.0, 1.0, 2.0)');
+
+CREATE TRIGGER IF NOT EXISTS books_fts_ai AFTER INSERT ON books BEGIN
+    INSERT INTO books_fts(rowid, book_name, author, "desc", isbn)
+    VALUES (new.book_id, new.book_name, new.author, new."desc", new.isbn);
+END;
+
+CREATE TRIGGER IF NOT EXISTS books_fts_ad AFTER DELETE ON books BEGIN
+    INSERT INTO books_fts(books_fts, rowid, book_name, author, "desc", isbn)
+    VALUES ('delete', old.book_id, old.book_name, old.author, old."desc", old.isbn);
+END;
+
+CREATE TRIGGER IF NOT EXISTS books_fts_au AFTER UPDATE OF book_name, author, "desc", isbn ON books BEGIN
+    INSERT INTO books_fts(books_fts, rowid, book_name, author, "desc", isbn)
+    VALUES ('delete', old.book_id, old.book_name, old.author, old."desc", old.isbn);
+    INSERT INTO books_fts(rowid, book_name, author, "desc", isbn)
+    VALUES (new.book_id, new.book_name, new.author, new."desc", new.isbn);
+END;
+
+INSERT INTO books_fts(books_fts) VALUES ('rebuild');
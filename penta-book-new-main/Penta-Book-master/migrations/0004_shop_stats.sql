@@ -0,0 +1,73 @@
+-- Per-shop sales and stock totals read by the shop dashboard and profile. Triggers keep the
+-- row current inside the same transaction that marks an order paid or changes books.stock;
+-- `flask rebuild-shop-stats` recomputes it from scratch.
+CREATE TABLE IF NOT EXISTS shop_stats (
+    shop_id     INTEGER PRIMARY KEY,
+    books_sold  INTEGER NOT NULL DEFAULT 0,
+    total_sales REAL    NOT NULL DEFAULT 0,
+    total_stock INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TRIGGER IF NOT EXISTS shop_stats_order_paid AFTER UPDATE OF status ON orders
+WHEN new.status = 'paid' AND old.status IS NOT 'paid'
+BEGIN
+    INSERT INTO shop_stats (shop_id, books_sold, total_sales)
+    SELECT shop_id, SUM(IFNULL(quantity, 0)), SUM(IFNULL(total_price, 0))
+    FROM orderitems
+    WHERE order_id = new.order_id AND shop_id IS NOT NULL
+    GROUP BY shop_id
+    ON CONFLICT (shop_id) DO UPDATE SET
+        books_sold = books_sold + excluded.books_sold,
+        total_sales = total_sales + excluded.total_sales;
+END;
+
+CREATE TRIGGER IF NOT EXISTS shop_stats_order_unpaid AFTER UPDATE OF status ON orders
+WHEN old.status = 'paid' AND new.status IS NOT 'paid'
+BEGIN
+    UPDATE shop_stats SET
+        books_sold = books_sold - (SELECT SUM(IFNULL(quantity, 0)) FROM orderitems
+                                   WHERE order_id = new.order_id AND orderitems.shop_id = shop_stats.shop_id),
+        total_sales = total_sales - (SELECT SUM(IFNULL(total_price, 0)) FROM orderitems
+                                     WHERE order_id = new.order_id AND orderitems.shop_id = shop_stats.shop_id)
+    WHERE shop_id IN (SELECT shop_id FROM orderitems WHERE order_id = new.order_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS shop_stats_book_insert AFTER INSERT ON books
+WHEN new.shop_id IS NOT NULL
+BEGIN
+    INSERT INTO shop_stats (shop_id, total_stock) VALUES (new.shop_id, IFNULL(new.stock, 0))
+    ON CONFLICT (shop_id) DO UPDATE SET total_stock = total_stock + excluded.total_stock;
+END;
+
+CREATE TRIGGER IF NOT EXISTS shop_stats_book_delete AFTER DELETE ON books
+WHEN old.shop_id IS NOT NULL
+BEGIN
+    UPDATE shop_stats SET total_stock = total_stock - IFNULL(old.stock, 0) WHERE shop_id = old.shop_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS shop_stats_book_update AFTER UPDATE OF stock, shop_id ON books
+BEGIN
+    UPDATE shop_stats SET total_stock = total_stock - IFNULL(old.stock, 0) WHERE shop_id = old.shop_id;
+    INSERT INTO shop_stats (shop_id, total_stock)
+    SELECT new.shop_id, IFNULL(new.stock, 0) WHERE new.shop_id IS NOT NULL
+    ON CONFLICT (shop_id) DO UPDATE SET total_stock = total_stock + excluded.total_stock;
+END;
+
+CREATE TRIGGER IF NOT EXISTS shop_stats_shop_delete AFTER DELETE ON shop
+BEGIN
+    DELETE FROM shop_stats WHERE shop_id = old.shop_id;
+END;
+
+DELETE FROM shop_stats;
+INSERT INTO shop_stats (shop_id, books_sold, total_sales, total_stock)
+SELECT shop.shop_id, IFNULL(sales.books_sold, 0), IFNULL(sales.total_sales, 0), IFNULL(stock.total_stock, 0)
+FROM shop
+LEFT JOIN (
+    SELECT orderitems.shop_id, SUM(orderitems.quantity) AS books_sold, SUM(orderitems.total_price) AS total_sales
+    FROM orders JOIN orderitems ON orders.order_id = orderitems.order_id
+    WHERE orders.status = 'paid'
+    GROUP BY orderitems.shop_id
+) AS sales ON sales.shop_id = shop.shop_id
+LEFT JOIN (
+    SELECT shop_id, SUM(stock) AS total_stock FROM books GROUP BY shop_id
+) AS stock ON stock.shop_id = shop.shop_id;
@@ -0,0 +1,5 @@
+-- Version counters for cache namespaces, shared by every worker process (see cache.SQLiteVersions).
+CREATE TABLE IF NOT EXISTS cache_versions (
+    namespace TEXT PRIMARY KEY,
+    version   INTEGER NOT NULL
+) WITHOUT ROWID;
@@ -0,0 +1,18 @@
+-- At most one open cart per buyer and one line per book in a cart, so add_to_cart can upsert.
+UPDATE cart SET status = 'abandoned'
+WHERE status = 'open'
+  AND cart_id NOT IN (SELECT MAX(cart_id) FROM cart WHERE status = 'open' GROUP BY buyer_id);
+
+UPDATE cartitems SET quantity = (
+    SELECT SUM(quantity) FROM cartitems AS dup
+    WHERE dup.cart_id = cartitems.cart_id AND dup.book_id = cartitems.book_id
+)
+WHERE cart_item_id IN (
+    SELECT MIN(cart_item_id) FROM cartitems GROUP BY cart_id, book_id HAVING COUNT(*) > 1
+);
+DELETE FROM cartitems
+WHERE cart_item_id NOT IN (SELECT MIN(cart_item_id) FROM cartitems GROUP BY cart_id, book_id);
+
+DROP INDEX IF EXISTS idx_cartitems_cart_book;
+CREATE UNIQUE INDEX IF NOT EXISTS uq_cartitems_cart_book ON cartitems (cart_id, book_id);
+CREATE UNIQUE INDEX IF NOT EXISTS uq_cart_open_buyer ON cart (buyer_id) WHERE status = 'open';
@@ -0,0 +1,20 @@
+-- Durable queue of payment submissions processed by the payment workers.
+-- status: queued -> running -> succeeded | failed; a running job whose lock expires is picked up again.
+CREATE TABLE IF NOT EXISTS payment_jobs (
+    job_id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    order_id       INTEGER NOT NULL REFERENCES orders,
+    method_id      INTEGER NOT NULL,
+    status         TEXT    NOT NULL DEFAULT 'queued',
+    attempts       INTEGER NOT NULL DEFAULT 0,
+    run_after      REAL    NOT NULL DEFAULT 0,
+    locked_until   REAL,
+    transaction_id TEXT,
+    error          TEXT,
+    created_at     TEXT    NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at     TEXT    NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_payment_jobs_active_order ON payment_jobs (order_id)
+    WHERE status IN ('queued', 'running');
+CREATE INDEX IF NOT EXISTS idx_payment_jobs_ready ON payment_jobs (status, run_after);
+CREATE INDEX IF NOT EXISTS idx_payment_jobs_order ON payment_jobs (order_id, job_id);
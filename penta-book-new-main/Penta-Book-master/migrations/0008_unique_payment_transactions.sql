@@ -0,0 +1,3 @@
+-- A gateway transaction is recorded at most once, even if a payment job is replayed.
+CREATE UNIQUE INDEX IF NOT EXISTS uq_payments_transaction_id ON payments (transaction_id)
+    WHERE transaction_id IS NOT NULL;
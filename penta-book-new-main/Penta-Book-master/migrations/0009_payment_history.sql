@@ -0,0 +1,24 @@
+-- Append-only log of every payment the gateway approved, newest entries found by entry_id.
+CREATE TABLE IF NOT EXISTS payment_history (
+    entry_id       INTEGER PRIMARY KEY AUTOINCREMENT,
+    transaction_id TEXT    NOT NULL UNIQUE,
+    order_id       INTEGER NOT NULL,
+    method_id      TEXT    NOT NULL,
+    method_name    TEXT    NOT NULL,
+    amount         REAL    NOT NULL,
+    payment_status TEXT    NOT NULL,
+    created_at     REAL    NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_payment_history_order ON payment_history (order_id, entry_id);
+CREATE INDEX IF NOT EXISTS idx_payment_history_created ON payment_history (created_at, entry_id);
+
+CREATE TRIGGER IF NOT EXISTS payment_history_no_update BEFORE UPDATE ON payment_history
+BEGIN
+    SELECT RAISE(ABORT, 'payment_history is append-only');
+END;
+
+CREATE TRIGGER IF NOT EXISTS payment_history_no_delete BEFORE DELETE ON payment_history
+BEGIN
+    SELECT RAISE(ABORT, 'payment_history is append-only');
+END;
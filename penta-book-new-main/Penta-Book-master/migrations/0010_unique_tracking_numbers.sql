@@ -0,0 +1,22 @@
+-- Tracking numbers identify a shipment; make the lookup index enforce that.
+-- Existing collisions are resolved first so the unique index can be built: blank numbers become
+-- NULL, a shipment recorded twice for the same order keeps only its first row, and a number
+-- shared by different orders stays with the first shipment while later ones get their
+-- shipment_id appended.
+UPDATE shipment SET tracking_no = NULL WHERE TRIM(tracking_no) = '';
+
+DELETE FROM shipment
+WHERE tracking_no IS NOT NULL AND EXISTS (
+    SELECT 1 FROM shipment AS first
+    WHERE first.tracking_no = shipment.tracking_no
+      AND first.order_id IS shipment.order_id
+      AND first.shipment_id < shipment.shipment_id);
+
+UPDATE shipment SET tracking_no = tracking_no || '-' || shipment_id
+WHERE tracking_no IS NOT NULL AND EXISTS (
+    SELECT 1 FROM shipment AS first
+    WHERE first.tracking_no = shipment.tracking_no
+      AND first.shipment_id < shipment.shipment_id);
+
+DROP INDEX IF EXISTS idx_shipment_tracking_no;
+CREATE UNIQUE INDEX IF NOT EXISTS uq_shipment_tracking_no ON shipment (tracking_no);
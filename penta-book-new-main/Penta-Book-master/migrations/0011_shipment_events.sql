@@ -0,0 +1,24 @@
+-- Shipment lifecycle: the carrier advances each shipment when next_status_at passes and records
+-- every status change in shipment_events; consumers track how far they have read in event_cursors.
+ALTER TABLE shipment ADD COLUMN next_status_at REAL;
+UPDATE shipment SET next_status_at = CAST(strftime('%s', 'now') AS REAL)
+WHERE status IS NOT 'Delivered' AND tracking_no IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_shipment_next_status ON shipment (next_status_at) WHERE next_status_at IS NOT NULL;
+
+CREATE TABLE IF NOT EXISTS shipment_events (
+    event_id    INTEGER PRIMARY KEY AUTOINCREMENT,
+    tracking_no TEXT    NOT NULL,
+    order_id    INTEGER NOT NULL,
+    status      TEXT    NOT NULL,
+    occurred_at TEXT    NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_shipment_events_tracking ON shipment_events (tracking_no, event_id);
+
+INSERT INTO shipment_events (tracking_no, order_id, status, occurred_at)
+SELECT tracking_no, order_id, IFNULL(status, 'Shipped'), IFNULL(received_date, IFNULL(shipment_date, CURRENT_TIMESTAMP))
+FROM shipment WHERE tracking_no IS NOT NULL ORDER BY shipment_id;
+
+CREATE TABLE IF NOT EXISTS event_cursors (
+    consumer TEXT    PRIMARY KEY,
+    position INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
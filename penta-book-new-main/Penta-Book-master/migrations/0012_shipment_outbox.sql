@@ -0,0 +1,20 @@
+-- Shipments requested by shops, written in the same transaction as the request and sent to the
+-- carrier by the shipment dispatcher.
+-- status: pending -> sending -> sent | dead; a sending entry whose lock expires is picked up again.
+CREATE TABLE IF NOT EXISTS shipment_outbox (
+    outbox_id        INTEGER PRIMARY KEY AUTOINCREMENT,
+    order_id         INTEGER NOT NULL REFERENCES orders,
+    shipment_service TEXT,
+    status           TEXT    NOT NULL DEFAULT 'pending',
+    attempts         INTEGER NOT NULL DEFAULT 0,
+    run_after        REAL    NOT NULL DEFAULT 0,
+    locked_until     REAL,
+    tracking_no      TEXT,
+    error            TEXT,
+    created_at       TEXT    NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at       TEXT    NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_shipment_outbox_live_order ON shipment_outbox (order_id)
+    WHERE status IN ('pending', 'sending', 'sent');
+CREATE INDEX IF NOT EXISTS idx_shipment_outbox_ready ON shipment_outbox (status, run_after);
@@ -0,0 +1,49 @@
+-- Account totals shown by the admin console, kept current by triggers so the summary never has
+-- to COUNT(*) the buyer and shop tables. Rows: buyers, shops, verified_shops.
+CREATE TABLE IF NOT EXISTS account_counts (
+    name  TEXT    PRIMARY KEY,
+    value INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS account_counts_buyer_insert AFTER INSERT ON buyer
+BEGIN
+    UPDATE account_counts SET value = value + 1 WHERE name = 'buyers';
+END;
+
+CREATE TRIGGER IF NOT EXISTS account_counts_buyer_delete AFTER DELETE ON buyer
+BEGIN
+    UPDATE account_counts SET value = value - 1 WHERE name = 'buyers';
+END;
+
+CREATE TRIGGER IF NOT EXISTS account_counts_shop_insert AFTER INSERT ON shop
+BEGIN
+    UPDATE account_counts SET value = value + 1 WHERE name = 'shops';
+    UPDATE account_counts SET value = value + 1 WHERE name = 'verified_shops' AND new.isverified = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS account_counts_shop_delete AFTER DELETE ON shop
+BEGIN
+    UPDATE account_counts SET value = value - 1 WHERE name = 'shops';
+    UPDATE account_counts SET value = value - 1 WHERE name = 'verified_shops' AND old.isverified = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS account_counts_shop_verify AFTER UPDATE OF isverified ON shop
+WHEN (old.isverified = 1) IS NOT (new.isverified = 1)
+BEGIN
+    UPDATE account_counts SET value = value + CASE WHEN new.isverified = 1 THEN 1 ELSE -1 END
+    WHERE name = 'verified_shops';
+END;
+
+DELETE FROM account_counts;
+INSERT INTO account_counts (name, value) VALUES
+    ('buyers', (SELECT COUNT(*) FROM buyer)),
+    ('shops', (SELECT COUNT(*) FROM shop)),
+    ('verified_shops', (SELECT COUNT(*) FROM shop WHERE isverified = 1));
+
+-- Case-insensitive prefix search on names and emails (LIKE uses these with the default
+-- case_sensitive_like = OFF), and the queue of shops still waiting for verification.
+CREATE INDEX IF NOT EXISTS idx_buyer_username_nocase ON buyer (username COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_buyer_email_nocase ON buyer (email COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_shop_name_nocase ON shop (shop_name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_shop_email_nocase ON shop (shop_email COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_shop_unverified ON shop (shop_id) WHERE IFNULL(isverified, 0) != 1;
@@ -0,0 +1,4 @@
+-- Marks jobs the gateway definitively declined. The gateway Idempotency-Key of an order only
+-- changes after a decline, so a job that gave up with an unknown outcome hands its key on to
+-- the next job for the order and the gateway can never charge the order twice.
+ALTER TABLE payment_jobs ADD COLUMN declined INTEGER NOT NULL DEFAULT 0;
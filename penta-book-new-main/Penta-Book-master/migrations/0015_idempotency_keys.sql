@@ -0,0 +1,13 @@
+-- First responses remembered per idempotency key, shared by the app's payment form and the
+-- mock gateway. Databases that already have the table from before it was a migration keep it.
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    scope       TEXT    NOT NULL,
+    key         TEXT    NOT NULL,
+    status_code INTEGER,
+    response    TEXT,
+    created_at  REAL    NOT NULL,
+    expires_at  REAL    NOT NULL,
+    PRIMARY KEY (scope, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires ON idempotency_keys (expires_at);
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created ON idempotency_keys (scope, created_at);
@@ -0,0 +1,49 @@
+-- One row per (shop, order) the shop sold lines in, carrying the order's sort date and status so
+-- the shop order lists can walk (shop_id, sort_date, order_id) in index order instead of
+-- grouping every orderitems row and sorting the result. Triggers keep it in step with
+-- orderitems and orders.
+CREATE TABLE IF NOT EXISTS shop_orders (
+    shop_id   INTEGER NOT NULL,
+    order_id  INTEGER NOT NULL,
+    sort_date TEXT    NOT NULL DEFAULT '',
+    status    TEXT,
+    PRIMARY KEY (shop_id, order_id)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_shop_orders_date ON shop_orders (shop_id, sort_date, order_id);
+CREATE INDEX IF NOT EXISTS idx_shop_orders_status_date ON shop_orders (shop_id, status, sort_date, order_id);
+CREATE INDEX IF NOT EXISTS idx_shop_orders_order ON shop_orders (order_id);
+
+CREATE TRIGGER IF NOT EXISTS shop_orders_item_insert AFTER INSERT ON orderitems
+WHEN new.shop_id IS NOT NULL
+BEGIN
+    INSERT INTO shop_orders (shop_id, order_id, sort_date, status)
+    SELECT new.shop_id, order_id, IFNULL(order_date, ''), status FROM orders WHERE order_id = new.order_id
+    ON CONFLICT (shop_id, order_id) DO NOTHING;
+END;
+
+CREATE TRIGGER IF NOT EXISTS shop_orders_item_delete AFTER DELETE ON orderitems
+WHEN old.shop_id IS NOT NULL
+BEGIN
+    DELETE FROM shop_orders
+    WHERE shop_id = old.shop_id AND order_id = old.order_id
+      AND NOT EXISTS (SELECT 1 FROM orderitems WHERE shop_id = old.shop_id AND order_id = old.order_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS shop_orders_order_update AFTER UPDATE OF status, order_date ON orders
+BEGIN
+    UPDATE shop_orders SET status = new.status, sort_date = IFNULL(new.order_date, '')
+    WHERE order_id = new.order_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS shop_orders_order_delete AFTER DELETE ON orders
+BEGIN
+    DELETE FROM shop_orders WHERE order_id = old.order_id;
+END;
+
+DELETE FROM shop_orders;
+INSERT INTO shop_orders (shop_id, order_id, sort_date, status)
+SELECT DISTINCT orderitems.shop_id, orders.order_id, IFNULL(orders.order_date, ''), orders.status
+FROM orderitems
+JOIN orders ON orders.order_id = orderitems.order_id
+WHERE orderitems.shop_id IS NOT NULL;
@@ -0,0 +1,4 @@
+-- An in-progress idempotency claim (status_code NULL) is only held until locked_until; after
+-- that another request may take the key over instead of waiting out the whole TTL. Claims
+-- left from before this column existed count as expired.
+ALTER TABLE idempotency_keys ADD COLUMN locked_until REAL;
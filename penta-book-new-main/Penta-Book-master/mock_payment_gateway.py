@@ -1,62 +1,181 @@
 from flask import Flask, request, jsonify
 import uuid
 import logging
-import sqlite3
+import time
+from collections import deque
+from datetime import datetime, timezone
+import migrate
+from cache import LRUCache
+from config import Config
+from database import get_pool
+from fault_injection import FaultInjector
+from idempotency import IN_PROGRESS, IdempotencyStore
+from pagination import keyset_page
 
 app = Flask(__name__)
+faults = FaultInjector.from_json(Config.PAYMENT_FAULTS, admin_token=Config.FAULTS_ADMIN_TOKEN).install(app)
 
 # Configuring logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-# In-memory store for payment activities
-payment_history = []
+# The most recent payment activities; the full history lives in the payment_history table.
+payment_history = deque(maxlen=Config.GATEWAY_HISTORY_BUFFER)
 
 
 def get_db():
-    conn = sqlite3.connect('penta_book.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+    return get_pool(Config.DATABASE, size=Config.DB_POOL_SIZE).connection()
+
+
+if Config.AUTO_MIGRATE:
+    with get_db() as db:
+        migrate.upgrade(db)
+
+
+payment_idempotency = IdempotencyStore(get_pool(Config.DATABASE, size=Config.DB_POOL_SIZE), 'gateway.process_payment',
+                                       ttl=Config.IDEMPOTENCY_TTL, lease=Config.IDEMPOTENCY_LEASE_SECONDS,
+                                       max_entries=Config.IDEMPOTENCY_MAX_ENTRIES)
+
+
+# Payment methods rarely change, so they are read from the database at most once per TTL.
+payment_methods_cache = LRUCache(maxsize=1, ttl=Config.GATEWAY_METHODS_TTL)
 
 
 # Retrieving valid payment methods from the database
 def get_valid_payment_methods():
+    methods = payment_methods_cache.get('methods')
+    if methods is not None:
+        return methods
     try:
-        db = get_db()
-        cur = db.execute('SELECT method_id, method_name FROM paymentmethods')
-        payment_methods = cur.fetchall()
-        return {str(method['method_id']): method['method_name'] for method in payment_methods}
+        with get_db() as db:
+            payment_methods = db.execute('SELECT method_id, method_name FROM paymentmethods').fetchall()
     except Exception as e:
         logger.error(f"Error retrieving payment methods from database: {e}")
         return {}
+    methods = {str(method['method_id']): method['method_name'] for method in payment_methods}
+    payment_methods_cache.set('methods', methods)
+    return methods
+
+
+def run_idempotent(key, handler):
+    """Run `handler()` -> (body, status_code) once per Idempotency-Key and replay its response for retries."""
+    if key:
+        previous = payment_idempotency.begin(key)
+        if previous is IN_PROGRESS:
+            return jsonify({'status': 'failed', 'message': 'A request with this Idempotency-Key is in progress'}), 409
+        if previous is not None:
+            status_code, body = previous
+            app.logger.debug(f"Replaying response for Idempotency-Key {key}")
+            return jsonify(body), status_code, {'Idempotent-Replayed': 'true'}
+
+    try:
+        body, status_code = handler()
+    except Exception:
+        if key:
+            payment_idempotency.release(key)
+        raise
+    if key:
+        payment_idempotency.complete(key, status_code, body)
+    return jsonify(body), status_code
 
 
 @app.route('/process_payment', methods=['POST'])
 def process_payment():
-    data = request.json
+    # A retried request carrying the same Idempotency-Key gets the first response back unchanged.
+    return run_idempotent(request.headers.get('Idempotency-Key'), lambda: handle_single_payment(request.json))
+
+
+@app.route('/process_payments_batch', methods=['POST'])
+def process_payments_batch():
+    # Accepts {"payments": [...]} and answers with one result per item, in request order.
+    data = request.get_json(silent=True)
+    payments = data.get('payments') if isinstance(data, dict) else None
+    if not isinstance(payments, list) or not payments:
+        return jsonify({'status': 'failed', 'message': 'payments must be a non-empty list'}), 400
+    if len(payments) > Config.GATEWAY_BATCH_MAX_ITEMS:
+        return jsonify({'status': 'failed',
+                        'message': f'At most {Config.GATEWAY_BATCH_MAX_ITEMS} payments per batch'}), 413
+    key = request.headers.get('Idempotency-Key')
+    return run_idempotent(key and f'batch:{key}', lambda: handle_payments_batch(payments))
+
+
+def handle_payments_batch(payments):
+    valid_payment_methods = get_valid_payment_methods()
+    results = []
+    entries = []
+    for index, item in enumerate(payments):
+        if isinstance(item, dict):
+            body, status_code = handle_payment(item, valid_payment_methods)
+        else:
+            body, status_code = {'status': 'failed', 'message': 'Payment must be an object'}, 400
+        if status_code == 200:
+            entries.append(history_entry(item, body['data']))
+        results.append(dict(body, index=index, status_code=status_code))
+    record_payments(entries)
+    approved = len(entries)
+    app.logger.info(f'Processed payment batch: {approved} approved, {len(results) - approved} failed')
+    return {'status': 'success', 'data': results,
+            'summary': {'total': len(results), 'approved': approved, 'failed': len(results) - approved}}, 200
+
+
+def history_entry(data, result):
+    return {
+        'transaction_id': result['transaction_id'],
+        'order_id': result['order_id'],
+        'method_id': result['method_id'],
+        'method_name': result['method_name'],
+        'amount': data['amount'],
+        'payment_status': result['payment_status'],
+        'created_at': time.time(),
+    }
+
+
+def record_payments(entries):
+    """Append approved payments to the durable log and to the in-memory ring buffer."""
+    if not entries:
+        return
+    with get_db() as db:
+        with db:
+            db.executemany('''
+                INSERT INTO payment_history
+                    (transaction_id, order_id, method_id, method_name, amount, payment_status, created_at)
+                VALUES (:transaction_id, :order_id, :method_id, :method_name, :amount, :payment_status, :created_at)
+            ''', entries)
+    payment_history.extend(entries)
+
+
+def handle_single_payment(data):
+    body, status_code = handle_payment(data)
+    if status_code == 200:
+        record_payments([history_entry(data, body['data'])])
+    return body, status_code
+
+
+def handle_payment(data, valid_payment_methods=None):
     app.logger.debug(f"Received payment request: {data}")
 
     if not data.get('amount') or not isinstance(data['amount'], (int, float)):
         app.logger.debug('Validation Error: Missing or invalid amount')
-        return jsonify({'status': 'failed', 'message': 'Missing or invalid amount'}), 400
+        return {'status': 'failed', 'message': 'Missing or invalid amount'}, 400
     if not data.get('method_id'):
         app.logger.debug('Validation Error: Missing method_id')
-        return jsonify({'status': 'failed', 'message': 'Missing method_id'}), 400
+        return {'status': 'failed', 'message': 'Missing method_id'}, 400
     if not data.get('method_name'):
         app.logger.debug('Validation Error: Missing method_name')
-        return jsonify({'status': 'failed', 'message': 'Missing method_name'}), 400
+        return {'status': 'failed', 'message': 'Missing method_name'}, 400
     if not data.get('order_id'):
         app.logger.debug('Validation Error: Missing order_id')
-        return jsonify({'status': 'failed', 'message': 'Missing order_id'}), 400
+        return {'status': 'failed', 'message': 'Missing order_id'}, 400
 
-    # Fetch valid payment methods from the database
-    valid_payment_methods = get_valid_payment_methods()
+    # Batches pass the methods they loaded once; single requests read them from the cache.
+    if valid_payment_methods is None:
+        valid_payment_methods = get_valid_payment_methods()
     method_id = str(data['method_id'])
     app.logger.debug(f"Validating method_id: {method_id} and method_name: {data['method_name']}")
 
     if method_id not in valid_payment_methods or valid_payment_methods[method_id] != data['method_name']:
         app.logger.debug(f"Validation Error: Invalid method_id ({method_id}) or method_name ({data['method_name']})")
-        return jsonify({'status': 'failed', 'message': 'Invalid method_id or method_name'}), 400
+        return {'status': 'failed', 'message': 'Invalid method_id or method_name'}, 400
 
     # Simulate transaction processing
     transaction_id = str(uuid.uuid4())
@@ -73,12 +192,67 @@ def process_payment():
 
     app.logger.info(f'Processed payment: {response}')
 
-    return jsonify({'status': 'success', 'data': response}), 200
+    return {'status': 'success', 'data': response}, 200
+
+
+def parse_time(value):
+    """Parse an ISO 8601 date or datetime (UTC unless it has an offset) into a Unix timestamp."""
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+def history_json(entry):
+    return dict(entry, created_at=datetime.fromtimestamp(entry['created_at'], timezone.utc).isoformat())
 
 
 @app.route('/payment_history', methods=['GET'])
 def get_payment_history():
-    return jsonify({'status': 'success', 'data': payment_history}), 200
+    # Newest first. Filters: order_id, method (id or name), from (inclusive) and to (exclusive) as ISO dates.
+    where, params = [], []
+    order_id = request.args.get('order_id', type=int)
+    if order_id is not None:
+        where.append('order_id = ?')
+        params.append(order_id)
+    method = request.args.get('method')
+    if method:
+        where.append('(method_id = ? OR method_name = ?)')
+        params.extend([method, method])
+    try:
+        if request.args.get('from'):
+            where.append('created_at >= ?')
+            params.append(parse_time(request.args['from']))
+        if request.args.get('to'):
+            where.append('created_at < ?')
+            params.append(parse_time(request.args['to']))
+    except ValueError:
+        return jsonify({'status': 'failed', 'message': 'from and to must be ISO 8601 dates'}), 400
+
+    limit = request.args.get('limit', Config.GATEWAY_HISTORY_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, Config.GATEWAY_HISTORY_MAX_PAGE_SIZE))
+    with get_db() as db:
+        page = keyset_page(
+            db,
+            'SELECT entry_id, transaction_id, order_id, method_id, method_name, amount, payment_status, created_at '
+            'FROM payment_history',
+            where, params, [('entry_id', 'entry_id')], descending=True, limit=limit,
+            after=request.args.get('cursor'), before=request.args.get('before'))
+    return jsonify({
+        'status': 'success',
+        'data': [history_json(dict(row)) for row in page.rows],
+        'next_cursor': page.next_cursor,
+        'prev_cursor': page.prev_cursor,
+    }), 200
+
+
+@app.route('/payment_history/recent', methods=['GET'])
+def get_recent_payment_history():
+    # Served from this process's ring buffer without touching the database.
+    limit = request.args.get('limit', Config.GATEWAY_HISTORY_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, Config.GATEWAY_HISTORY_MAX_PAGE_SIZE))
+    recent = list(payment_history)[-limit:]
+    return jsonify({'status': 'success', 'data': [history_json(entry) for entry in reversed(recent)]}), 200
 
 
 if __name__ == '__main__':
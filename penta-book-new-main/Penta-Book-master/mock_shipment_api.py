@@ -1,15 +1,58 @@
 from flask import Flask, request, jsonify
-import sqlite3
-import random
 import datetime
+import json
+import os
+import time
+import uuid
+import migrate
+from config import Config
+from database import get_pool, immediate_transaction
+from fault_injection import FaultInjector
+from workers import WorkerPool
 
 app = Flask(__name__)
+faults = FaultInjector.from_json(Config.SHIPMENT_FAULTS, admin_token=Config.FAULTS_ADMIN_TOKEN).install(app)
 
 
 def get_db():
-    db = sqlite3.connect('penta_book.db')  # Update this path
-    db.row_factory = sqlite3.Row
-    return db
+    return get_pool(Config.DATABASE, size=Config.DB_POOL_SIZE).connection()
+
+
+if Config.AUTO_MIGRATE:
+    with get_db() as db:
+        migrate.upgrade(db)
+
+
+# Statuses a shipment moves through, one stage every SHIPMENT_STAGE_SECONDS.
+LIFECYCLE = ('Shipped', 'In Transit', 'Out for Delivery', 'Delivered')
+
+
+def next_status(status):
+    if status not in LIFECYCLE:
+        return LIFECYCLE[1]
+    return LIFECYCLE[min(LIFECYCLE.index(status) + 1, len(LIFECYCLE) - 1)]
+
+
+def record_events(db, events):
+    """Append (tracking_no, order_id, status, occurred_at) rows to the shipment event log."""
+    db.executemany('INSERT INTO shipment_events (tracking_no, order_id, status, occurred_at) VALUES (?, ?, ?, ?)',
+                   events)
+
+
+def new_tracking_no():
+    # Random 128-bit suffix: unique without coordinating between workers.
+    return 'TRK' + uuid.uuid4().hex.upper()
+
+
+def shipment_json(shipment):
+    return {
+        'tracking_no': shipment['tracking_no'],
+        'order_id': shipment['order_id'],
+        'shipment_date': shipment['shipment_date'],
+        'received_date': shipment['received_date'],
+        'status': shipment['status'],
+        'shipment_service': shipment['shipment_service']
+    }
 
 
 @app.route('/initiate_shipment', methods=['POST'])
@@ -17,54 +60,188 @@ def initiate_shipment():
     order_id = request.json.get('order_id')
     shipment_service = request.json.get('shipment_service', 'default_service')
 
-    db = get_db()
-    try:
-        # Check if the order exists
-        order = db.execute('SELECT * FROM orders WHERE order_id = ?', (order_id,)).fetchone()
-        if not order:
-            return jsonify({'status': 'error', 'message': 'Order not found.'}), 404
+    with get_db() as db:
+        try:
+            # Check if the order exists
+            order = db.execute('SELECT * FROM orders WHERE order_id = ?', (order_id,)).fetchone()
+            if not order:
+                return jsonify({'status': 'error', 'message': 'Order not found.'}), 404
 
-        # Generate a mock tracking number
-        tracking_no = 'TRK' + str(random.randint(100000, 999999))
+            # Generate a mock tracking number
+            tracking_no = new_tracking_no()
 
-        # Create shipment entry
-        db.execute('''
-            INSERT INTO shipment (order_id, tracking_no, shipment_date, status, shipment_service)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (order_id, tracking_no, datetime.datetime.now().isoformat(), 'Shipped', shipment_service))
-        db.commit()
+            # Create shipment entry
+            shipment_date = datetime.datetime.now().isoformat()
+            with db:
+                db.execute('''
+                    INSERT INTO shipment (order_id, tracking_no, shipment_date, status, shipment_service, next_status_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (order_id, tracking_no, shipment_date, 'Shipped', shipment_service,
+                      time.time() + Config.SHIPMENT_STAGE_SECONDS))
+                record_events(db, [(tracking_no, order_id, 'Shipped', shipment_date)])
 
-        return jsonify({'status': 'success', 'tracking_no': tracking_no}), 201
-    except Exception as e:
-        return jsonify({'status': 'error', 'message': str(e)}), 500
-    finally:
-        db.close()
+            return jsonify({'status': 'success', 'tracking_no': tracking_no}), 201
+        except Exception as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 500
 
 
 @app.route('/track_shipment/<tracking_no>', methods=['GET'])
 def track_shipment(tracking_no):
-    db = get_db()
-    try:
-        shipment = db.execute('SELECT * FROM shipment WHERE tracking_no = ?', (tracking_no,)).fetchone()
-        if not shipment:
-            return jsonify({'status': 'error', 'message': 'Shipment not found.'}), 404
-
-        return jsonify({
-            'status': 'success',
-            'shipment_data': {
-                'tracking_no': shipment['tracking_no'],
-                'order_id': shipment['order_id'],
-                'shipment_date': shipment['shipment_date'],
-                'received_date': shipment['received_date'],
-                'status': shipment['status'],
-                'shipment_service': shipment['shipment_service']
-            }
-        }), 200
-    except Exception as e:
-        return jsonify({'status': 'error', 'message': str(e)}), 500
-    finally:
-        db.close()
+    with get_db() as db:
+        try:
+            shipment = db.execute('SELECT * FROM shipment WHERE tracking_no = ?', (tracking_no,)).fetchone()
+            if not shipment:
+                return jsonify({'status': 'error', 'message': 'Shipment not found.'}), 404
+
+            return jsonify({'status': 'success', 'shipment_data': shipment_json(shipment)}), 200
+        except Exception as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+@app.route('/initiate_shipments', methods=['POST'])
+def initiate_shipments():
+    # Accepts {"shipments": [{"order_id": ..., "shipment_service": ...}, ...]} and answers with one
+    # result per item, in request order. An order that already has a shipment gets its existing
+    # tracking number back (created: false) instead of a second shipment.
+    data = request.get_json(silent=True)
+    items = data.get('shipments') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return jsonify({'status': 'error', 'message': 'shipments must be a non-empty list.'}), 400
+    if len(items) > Config.SHIPMENT_BATCH_MAX_ITEMS:
+        return jsonify({'status': 'error',
+                        'message': f'At most {Config.SHIPMENT_BATCH_MAX_ITEMS} shipments per request.'}), 413
+    order_ids = [item.get('order_id') if isinstance(item, dict) else None for item in items]
+
+    with get_db() as db:
+        try:
+            with immediate_transaction(db):
+                wanted = json.dumps([order_id for order_id in order_ids if isinstance(order_id, int)])
+                known = {row['order_id'] for row in db.execute(
+                    'SELECT order_id FROM orders WHERE order_id IN (SELECT value FROM json_each(?))', (wanted,))}
+                shipped = {row['order_id']: row for row in db.execute('''
+                    SELECT order_id, tracking_no, shipment_service FROM shipment
+                    WHERE order_id IN (SELECT value FROM json_each(?)) ORDER BY shipment_id
+                ''', (wanted,))}
+
+                results, new_rows = [], []
+                shipment_date = datetime.datetime.now().isoformat()
+                for index, (item, order_id) in enumerate(zip(items, order_ids)):
+                    if order_id not in known:
+                        results.append({'index': index, 'order_id': order_id, 'status': 'error',
+                                        'message': 'Order not found.'})
+                        continue
+                    existing = shipped.get(order_id)
+                    if existing is None:
+                        existing = shipped[order_id] = {
+                            'order_id': order_id,
+                            'tracking_no': new_tracking_no(),
+                            'shipment_service': item.get('shipment_service', 'default_service'),
+                        }
+                        new_rows.append(existing)
+                        created = True
+                    else:
+                        created = False
+                    results.append({'index': index, 'order_id': order_id, 'status': 'success',
+                                    'tracking_no': existing['tracking_no'],
+                                    'shipment_service': existing['shipment_service'], 'created': created})
+
+                db.executemany('''
+                    INSERT INTO shipment (order_id, tracking_no, shipment_date, status, shipment_service, next_status_at)
+                    VALUES (:order_id, :tracking_no, :shipment_date, 'Shipped', :shipment_service, :next_status_at)
+                ''', [dict(row, shipment_date=shipment_date, next_status_at=time.time() + Config.SHIPMENT_STAGE_SECONDS)
+                      for row in new_rows])
+                record_events(db, [(row['tracking_no'], row['order_id'], 'Shipped', shipment_date) for row in new_rows])
+        except Exception as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 500
+
+    return jsonify({'status': 'success', 'data': results, 'created': len(new_rows)}), 201
+
+
+@app.route('/track_shipments', methods=['GET', 'POST'])
+def track_shipments():
+    # GET ?tracking_no=A&tracking_no=B or POST {"tracking_nos": [...]}; one indexed query per batch.
+    if request.method == 'POST':
+        data = request.get_json(silent=True)
+        tracking_nos = data.get('tracking_nos') if isinstance(data, dict) else None
+    else:
+        tracking_nos = request.args.getlist('tracking_no')
+    if not isinstance(tracking_nos, list) or not tracking_nos:
+        return jsonify({'status': 'error', 'message': 'tracking_nos must be a non-empty list.'}), 400
+    if len(tracking_nos) > Config.SHIPMENT_BATCH_MAX_ITEMS:
+        return jsonify({'status': 'error',
+                        'message': f'At most {Config.SHIPMENT_BATCH_MAX_ITEMS} tracking numbers per request.'}), 413
+
+    with get_db() as db:
+        try:
+            found = {row['tracking_no']: shipment_json(row) for row in db.execute(
+                'SELECT * FROM shipment WHERE tracking_no IN (SELECT value FROM json_each(?))',
+                (json.dumps([str(tracking_no) for tracking_no in tracking_nos]),))}
+        except Exception as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 500
+
+    return jsonify({
+        'status': 'success',
+        'shipment_data': [found[str(t)] for t in tracking_nos if str(t) in found],
+        'missing': [t for t in tracking_nos if str(t) not in found],
+    }), 200
+
+
+@app.route('/shipment_events', methods=['GET'])
+def shipment_events():
+    # Events in log order after the `after` cursor (an event_id); pass next_cursor back to continue.
+    after = request.args.get('after', 0, type=int)
+    limit = max(1, min(request.args.get('limit', Config.SHIPMENT_EVENTS_BATCH, type=int),
+                       Config.SHIPMENT_BATCH_MAX_ITEMS))
+    with get_db() as db:
+        events = db.execute('''
+            SELECT event_id, tracking_no, order_id, status, occurred_at FROM shipment_events
+            WHERE event_id > ? ORDER BY event_id LIMIT ?
+        ''', (after, limit)).fetchall()
+    return jsonify({
+        'status': 'success',
+        'data': [dict(event) for event in events],
+        'next_cursor': events[-1]['event_id'] if events else after,
+        'has_more': len(events) == limit,
+    }), 200
+
+
+def advance_shipments():
+    """Move every shipment whose stage has elapsed to its next status; returns True if a full batch was due."""
+    now = time.time()
+    with get_db() as db:
+        with immediate_transaction(db):
+            due = db.execute('''
+                SELECT shipment_id, order_id, tracking_no, status FROM shipment
+                WHERE next_status_at <= ? ORDER BY next_status_at LIMIT ?
+            ''', (now, Config.SHIPMENT_EVENTS_BATCH)).fetchall()
+            occurred_at = datetime.datetime.now().isoformat()
+            updates, events = [], []
+            for shipment in due:
+                status = next_status(shipment['status'])
+                delivered = status == LIFECYCLE[-1]
+                updates.append((status, occurred_at if delivered else None,
+                                None if delivered else now + Config.SHIPMENT_STAGE_SECONDS, shipment['shipment_id']))
+                events.append((shipment['tracking_no'], shipment['order_id'], status, occurred_at))
+            db.executemany('''
+                UPDATE shipment SET status = ?, received_date = IFNULL(?, received_date), next_status_at = ?
+                WHERE shipment_id = ?
+            ''', updates)
+            record_events(db, events)
+    return len(due) == Config.SHIPMENT_EVENTS_BATCH
+
+
+lifecycle_engine = WorkerPool('shipment-lifecycle', advance_shipments, poll_interval=Config.SHIPMENT_ENGINE_INTERVAL)
+
+
+@app.before_request
+def start_lifecycle_engine():
+    # Only needed when another server imports this module; run directly it starts below.
+    lifecycle_engine.start()
 
 
 if __name__ == '__main__':
+    # Shipments advance from startup, not from the first request. The debug reloader runs this
+    # block in its watcher process too; only the serving child (WERKZEUG_RUN_MAIN) needs the engine.
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        lifecycle_engine.start()
     app.run(port=5002, debug=True)  # Running on a different port than the Flask app
\ No newline at end of file
@@ -0,0 +1,85 @@
+import base64
+import json
+from collections import namedtuple
+
+Page = namedtuple('Page', ['rows', 'next_cursor', 'prev_cursor'])
+
+
+def encode_cursor(values):
+    raw = json.dumps(list(values), separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        return None
+    return values if isinstance(values, list) else None
+
+
+def _after(keys, values, desc):
+    """The condition for rows strictly after `values` in the `keys` ordering.
+
+    Spelled out as `k1 >= ? AND (k1 > ? OR k2 > ?)` rather than the row value `(k1, k2) > (?, ?)`:
+    SQLite can only seek an index on the leading key (including expression indexes) with the
+    expanded form, so a deep page costs the same as the first one.
+    """
+    op = '<' if desc else '>'
+    expr, _ = keys[0]
+    if len(keys) == 1:
+        return f'{expr} {op} ?', [values[0]]
+    rest, rest_params = _after(keys[1:], values[1:], desc)
+    return f'{expr} {op}= ? AND ({expr} {op} ? OR {rest})', [values[0], values[0], *rest_params]
+
+
+def keyset_page(db, select_sql, where, params, keys, descending=False, limit=20,
+                after=None, before=None, group_by=None):
+    """Fetch one page of `select_sql` ordered by `keys` without using OFFSET.
+
+    `keys` is a list of (sql_expression, column_alias) pairs; the last one must be
+    unique so the ordering is total. Every alias has to be selected by `select_sql`
+    so the cursors can be built from the first and last rows of the page.
+    """
+    where = list(where)
+    params = list(params)
+    cursor = decode_cursor(before) or decode_cursor(after)
+    backwards = cursor is not None and decode_cursor(before) is not None
+
+    if cursor is not None and len(cursor) != len(keys):
+        cursor, backwards = None, False
+
+    desc = descending != backwards
+    if cursor is not None:
+        predicate, predicate_params = _after(keys, cursor, desc)
+        where.append(predicate)
+        params.extend(predicate_params)
+
+    sql = select_sql
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    if group_by:
+        sql += ' GROUP BY ' + group_by
+    sql += ' ORDER BY ' + ', '.join(f'{expr} {"DESC" if desc else "ASC"}' for expr, _ in keys)
+    sql += ' LIMIT ?'
+    params.append(limit + 1)
+
+    rows = db.execute(sql, params).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if backwards:
+        rows.reverse()
+
+    def cursor_for(row):
+        return encode_cursor(row[alias] for _, alias in keys)
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if backwards or has_more:
+            next_cursor = cursor_for(rows[-1])
+        if (backwards and has_more) or (not backwards and cursor is not None):
+            prev_cursor = cursor_for(rows[0])
+    return Page(rows, next_cursor, prev_cursor)
@@ -0,0 +1,157 @@
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+from cache import LRUCache
+
+
+# werkzeug's defaults for the cost arguments a method string may leave out.
+SCRYPT_DEFAULTS = (2 ** 15, 8, 1)
+
+
+class HasherBusy(RuntimeError):
+    pass
+
+
+def hash_parameters(method):
+    """Split a werkzeug method string ('pbkdf2:sha256:1000000', 'scrypt:32768:8:1', ...) into
+    (algorithm, costs), filling in werkzeug's defaults for anything left out."""
+    name, *args = method.split(':')
+    if name == 'pbkdf2':
+        hash_name = args[0] if args else 'sha256'
+        iterations = int(args[1]) if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return f'pbkdf2:{hash_name}', (iterations,)
+    if name == 'scrypt':
+        return name, tuple(map(int, args)) if args else SCRYPT_DEFAULTS
+    return method, ()
+
+
+class PasswordHasher:
+    """Hashes and checks passwords on a process pool so PBKDF2 work never runs on a request thread.
+
+    At most `max_pending` hashes may be queued or running at once; beyond that `hash()` and
+    `verify()` raise HasherBusy straight away instead of letting a login burst pile up behind
+    the pool. With `workers=0` the work runs inline, which is handy for the CLI and debugging.
+    `needs_rehash(stored)` tells whether a stored hash uses another algorithm than `method`,
+    or the same one at a lower cost; stronger hashes are never rewritten. `iterations` only
+    applies to pbkdf2 and defaults to werkzeug's current count.
+    """
+
+    def __init__(self, method='pbkdf2:sha256', iterations=None, workers=2, max_pending=32, timeout=10.0):
+        algorithm, costs = hash_parameters(method)
+        if algorithm.startswith('pbkdf2:'):
+            costs = (iterations or costs[0],)
+        self.method = ':'.join([algorithm, *map(str, costs)])
+        self._parameters = algorithm, costs
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                # Spawned, not forked: the app already runs worker threads by the time the first
+                # job arrives, and a forked child could inherit a lock one of them holds.
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def _run(self, fn, *args):
+        if self.workers <= 0:
+            return fn(*args)
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy('Too many password checks are waiting.')
+        try:
+            future = self._pool().submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise HasherBusy('Password check timed out.') from None
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, stored, password):
+        if not stored:
+            return False
+        return self._run(check_password_hash, stored, password)
+
+    def needs_rehash(self, stored):
+        if not stored:
+            return False
+        try:
+            algorithm, costs = hash_parameters(stored.split('$', 1)[0])
+        except ValueError:
+            return True
+        wanted_algorithm, wanted_costs = self._parameters
+        if algorithm != wanted_algorithm:
+            return True
+        return any(have < want for have, want in zip(costs, wanted_costs))
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+
+class AttemptLimiter:
+    """Counts attempts per (scope, key) in fixed windows of `window` seconds.
+
+    `limits` maps a scope (e.g. 'account', 'ip') to the attempts it allows per window;
+    `windows` can give a scope its own, longer window so its budget refills more slowly.
+    `reserve(keys)` atomically checks every key and, if none is locked out, counts the attempt
+    against all of them before the caller does the expensive check; it returns 0, or the
+    seconds until the keys are allowed again. Call `refund(keys)` when the attempt succeeded
+    (or was never checked) so only failures use up the budget.
+
+    The counters are process-local: they are not shared between worker processes or hosts,
+    so with N workers a client can make up to N times the configured attempts. Size the
+    limits for that, or route a client's logins to one worker.
+    """
+
+    def __init__(self, limits, window=900.0, maxsize=100000, windows=None):
+        self.limits = limits
+        self.window = window
+        self.windows = windows or {}
+        self._attempts = LRUCache(maxsize=maxsize, ttl=max([window, *self.windows.values()]))
+        self._lock = threading.Lock()
+
+    def reserve(self, keys):
+        now = time.monotonic()
+        with self._lock:
+            entries = [self._attempts.get((scope, key), (0, now + self.windows.get(scope, self.window)))
+                       for scope, key in keys]
+            wait = max((reset_at - now for (scope, _), (count, reset_at) in zip(keys, entries)
+                        if count >= self.limits[scope]), default=0.0)
+            if wait > 0:
+                return wait
+            for (scope, key), (count, reset_at) in zip(keys, entries):
+                self._attempts.set((scope, key), (count + 1, reset_at), ttl=max(reset_at - now, 0.0))
+            return 0.0
+
+    def refund(self, keys):
+        now = time.monotonic()
+        with self._lock:
+            for scope, key in keys:
+                entry = self._attempts.get((scope, key))
+                if entry is None:
+                    continue
+                count, reset_at = entry
+                if count <= 1:
+                    self._attempts.delete((scope, key))
+                else:
+                    self._attempts.set((scope, key), (count - 1, reset_at), ttl=max(reset_at - now, 0.0))
+
+    def stats(self):
+        return self._attempts.stats()
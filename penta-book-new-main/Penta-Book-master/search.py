@@ -0,0 +1,15 @@
+import re
+
+MAX_SEARCH_TERMS = 8
+
+
+def match_expression(text):
+    """Turn free text from the search box into a safe FTS5 MATCH expression.
+
+    Every word becomes a quoted prefix term, so "dun her" matches "Dune" by
+    "Frank Herbert" and FTS5 operators typed by the user are treated as text.
+    """
+    terms = re.findall(r'\w+', text or '')[:MAX_SEARCH_TERMS]
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"*' for term in terms)
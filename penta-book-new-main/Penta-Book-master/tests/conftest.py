@@ -0,0 +1,72 @@
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASE_DB = os.path.join(ROOT, 'penta_book.db')
+sys.path.insert(0, ROOT)
+
+# config.Config reads the environment at import time, so point the app at a scratch copy of the
+# bundled database before any test imports it; the checked-in file is never migrated or written.
+_app_dir = tempfile.mkdtemp(prefix='penta-book-tests-')
+os.environ['DATABASE'] = os.path.join(_app_dir, 'penta_book.db')
+os.environ.setdefault('JINJA_CACHE_DIR', os.path.join(_app_dir, 'jinja_cache'))
+shutil.copy(BASE_DB, os.environ['DATABASE'])
+
+
+@pytest.fixture
+def base_db(tmp_path):
+    """Path to a fresh, unmigrated copy of the bundled database."""
+    path = str(tmp_path / 'penta_book.db')
+    shutil.copy(BASE_DB, path)
+    return path
+
+
+@pytest.fixture
+def pool(base_db):
+    """A connection pool on a fully migrated scratch database."""
+    import migrate
+    from database import ConnectionPool
+
+    pool = ConnectionPool(base_db, size=4)
+    with pool.connection() as db:
+        migrate.upgrade(db)
+    yield pool
+    pool.close()
+
+
+@pytest.fixture(scope='session')
+def penta_app():
+    import app as app_module
+
+    app_module.app.config['TESTING'] = True
+    return app_module
+
+
+@pytest.fixture
+def app_db(penta_app):
+    """The app's own database connection inside an app context."""
+    with penta_app.app.app_context():
+        yield penta_app.get_db()
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=None, headers=None):
+        self.status_code = status_code
+        self.body = body or {}
+        self.headers = headers or {}
+        self.closed = False
+
+    def json(self):
+        return self.body
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def fake_response():
+    return FakeResponse
@@ -0,0 +1,172 @@
+import sqlite3
+import uuid
+
+import pytest
+
+
+@pytest.fixture
+def db(app_db):
+    with app_db:
+        app_db.execute('DELETE FROM payment_jobs')
+        app_db.execute('DELETE FROM shipment_outbox')
+    return app_db
+
+
+def new_order(db, status='initiated', order_date="datetime('now')"):
+    with db:
+        return db.execute(f'''
+            INSERT INTO orders (buyer_id, order_date, subtotal, total, status, delivery_address)
+            VALUES (2, {order_date}, 10, 10, ?, 'Test address') RETURNING order_id
+        ''', (status,)).fetchone()[0]
+
+
+def queue_job(db, order_id):
+    method_id = db.execute('SELECT MIN(method_id) FROM paymentmethods').fetchone()[0]
+    with db:
+        return db.execute('INSERT INTO payment_jobs (order_id, method_id) VALUES (?, ?) RETURNING job_id',
+                          (order_id, method_id)).fetchone()[0]
+
+
+def job_row(db, job_id):
+    return db.execute('SELECT * FROM payment_jobs WHERE job_id = ?', (job_id,)).fetchone()
+
+
+class FakeUpstream:
+    """Stands in for an UpstreamClient's post(), answering with the queued responses in turn."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def post(self, path, **kwargs):
+        self.calls.append((path, kwargs))
+        return self.responses.pop(0)
+
+
+def test_an_order_has_at_most_one_active_payment_job(db):
+    order_id = new_order(db)
+    queue_job(db, order_id)
+    with pytest.raises(sqlite3.IntegrityError):
+        queue_job(db, order_id)
+
+
+def test_claimed_job_is_locked_until_its_lease_expires(penta_app, db):
+    job_id = queue_job(db, new_order(db))
+    job = penta_app.claim_payment_job(db)
+    assert (job['job_id'], job['attempts']) == (job_id, 1)
+    assert penta_app.claim_payment_job(db) is None
+
+    with db:
+        db.execute('UPDATE payment_jobs SET locked_until = 0 WHERE job_id = ?', (job_id,))
+    job = penta_app.claim_payment_job(db)
+    assert (job['job_id'], job['attempts']) == (job_id, 2)
+
+
+def test_successful_charge_marks_the_order_paid(penta_app, db, monkeypatch, fake_response):
+    order_id = new_order(db)
+    job_id = queue_job(db, order_id)
+    transaction_id = f'TX-{uuid.uuid4().hex}'
+    gateway = FakeUpstream(fake_response(200, {'status': 'success', 'data': {
+        'transaction_id': transaction_id, 'payment_status': 'completed'}}))
+    monkeypatch.setattr(penta_app, 'payment_client', gateway)
+
+    penta_app.charge_payment_job(db, penta_app.claim_payment_job(db))
+
+    assert gateway.calls[0][1]['headers'] == {'Idempotency-Key': f'order-{order_id}-attempt-0'}
+    assert db.execute('SELECT status FROM orders WHERE order_id = ?', (order_id,)).fetchone()[0] == 'paid'
+    assert job_row(db, job_id)['status'] == 'succeeded'
+    assert db.execute('SELECT COUNT(*) FROM payments WHERE transaction_id = ?', (transaction_id,)).fetchone()[0] == 1
+
+
+def test_gateway_errors_requeue_the_job_under_the_same_key(penta_app, db, monkeypatch, fake_response):
+    order_id = new_order(db)
+    job_id = queue_job(db, order_id)
+    gateway = FakeUpstream(fake_response(503, {}), fake_response(409, {}))
+    monkeypatch.setattr(penta_app, 'payment_client', gateway)
+
+    for _ in range(2):
+        penta_app.charge_payment_job(db, penta_app.claim_payment_job(db))
+        job = job_row(db, job_id)
+        assert job['status'] == 'queued' and job['declined'] == 0
+        with db:
+            db.execute('UPDATE payment_jobs SET run_after = 0 WHERE job_id = ?', (job_id,))
+
+    keys = {kwargs['headers']['Idempotency-Key'] for _, kwargs in gateway.calls}
+    assert keys == {f'order-{order_id}-attempt-0'}
+
+
+def test_a_decline_gives_the_next_job_a_fresh_key(penta_app, db, monkeypatch, fake_response):
+    order_id = new_order(db)
+    job_id = queue_job(db, order_id)
+    monkeypatch.setattr(penta_app, 'payment_client',
+                        FakeUpstream(fake_response(402, {'status': 'error', 'message': 'Card declined.'})))
+    penta_app.charge_payment_job(db, penta_app.claim_payment_job(db))
+    job = job_row(db, job_id)
+    assert (job['status'], job['declined'], job['error']) == ('failed', 1, 'Card declined.')
+
+    next_job = job_row(db, queue_job(db, order_id))
+    assert penta_app.gateway_idempotency_key(db, next_job) == f'order-{order_id}-attempt-1'
+
+
+def test_expired_orders_release_their_stock(penta_app, db):
+    while penta_app.expire_unpaid_orders():  # stale orders already in the bundled database
+        pass
+    book = db.execute('SELECT book_id, shop_id, IFNULL(stock, 0) AS stock FROM books WHERE shop_id IS NOT NULL'
+                      ).fetchone()
+    order_id = new_order(db, order_date="datetime('now', '-2 days')")
+    with db:
+        db.execute('''
+            INSERT INTO orderitems (order_id, book_id, shop_id, quantity, price, total_price)
+            VALUES (?, ?, ?, 3, 10, 30)
+        ''', (order_id, book['book_id'], book['shop_id']))
+
+    while penta_app.expire_unpaid_orders():
+        pass
+
+    assert db.execute('SELECT status FROM orders WHERE order_id = ?', (order_id,)).fetchone()[0] == 'expired'
+    assert db.execute('SELECT stock FROM books WHERE book_id = ?', (book['book_id'],)).fetchone()[0] == book['stock'] + 3
+
+
+def queue_shipment(db, order_id):
+    with db:
+        return db.execute("INSERT INTO shipment_outbox (order_id, shipment_service) VALUES (?, 'standard') "
+                          'RETURNING outbox_id', (order_id,)).fetchone()[0]
+
+
+def outbox_row(db, outbox_id):
+    return db.execute('SELECT * FROM shipment_outbox WHERE outbox_id = ?', (outbox_id,)).fetchone()
+
+
+def test_dispatched_shipments_are_recorded_once(penta_app, db, monkeypatch, fake_response):
+    order_id = new_order(db, status='paid')
+    outbox_id = queue_shipment(db, order_id)
+    tracking_no = f'TRK{uuid.uuid4().hex.upper()}'
+    monkeypatch.setattr(penta_app, 'shipment_client', FakeUpstream(fake_response(200, {'data': [
+        {'status': 'success', 'tracking_no': tracking_no, 'shipment_service': 'standard'}]})))
+
+    assert penta_app.dispatch_shipments()
+    assert not penta_app.dispatch_shipments()
+
+    entry = outbox_row(db, outbox_id)
+    assert (entry['status'], entry['tracking_no']) == ('sent', tracking_no)
+    assert db.execute('SELECT COUNT(*) FROM shipment WHERE order_id = ?', (order_id,)).fetchone()[0] == 1
+    with pytest.raises(sqlite3.IntegrityError):
+        queue_shipment(db, order_id)
+
+
+def test_failed_dispatches_back_off_then_dead_letter(penta_app, db, monkeypatch, fake_response):
+    outbox_id = queue_shipment(db, new_order(db, status='paid'))
+    max_attempts = penta_app.app.config['SHIPMENT_DISPATCH_MAX_ATTEMPTS']
+    monkeypatch.setattr(penta_app, 'shipment_client',
+                        FakeUpstream(*[fake_response(503, {}) for _ in range(max_attempts)]))
+
+    assert penta_app.dispatch_shipments()
+    entry = outbox_row(db, outbox_id)
+    assert (entry['status'], entry['attempts']) == ('pending', 1)
+    assert not penta_app.dispatch_shipments()  # backing off
+
+    with db:
+        db.execute('UPDATE shipment_outbox SET attempts = ?, run_after = 0 WHERE outbox_id = ?',
+                   (max_attempts - 1, outbox_id))
+    assert penta_app.dispatch_shipments()
+    assert outbox_row(db, outbox_id)['status'] == 'dead'
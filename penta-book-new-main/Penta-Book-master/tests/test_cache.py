@@ -0,0 +1,37 @@
+from cache import Cache, LRUCache, SQLiteVersions
+
+
+def test_lru_evicts_least_recently_used_and_expires(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr('cache.time.monotonic', lambda: now[0])
+    cache = LRUCache(maxsize=2, ttl=10)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is None and cache.get('a') == 1
+    now[0] = 11
+    assert cache.get('a') is None
+    assert cache.stats()['evictions'] == 1 and cache.stats()['expirations'] == 1
+
+
+def test_invalidation_is_seen_by_every_process_sharing_the_table(pool):
+    # Two caches on one database stand in for two worker processes.
+    first = Cache(SQLiteVersions(pool, poll_interval=0))
+    second = Cache(SQLiteVersions(pool, poll_interval=0))
+    assert first.get_or_load('book:1', 'card', lambda: 'v1') == 'v1'
+    assert second.get_or_load('book:1', 'card', lambda: 'v1') == 'v1'
+
+    first.invalidate('book:1')
+    assert first.get_or_load('book:1', 'card', lambda: 'v2') == 'v2'
+    assert second.get_or_load('book:1', 'card', lambda: 'v2') == 'v2'
+    assert second.get_or_load('book:1', 'card', lambda: 'v3') == 'v2'
+
+
+def test_reading_a_namespace_writes_nothing(pool):
+    versions = SQLiteVersions(pool, maxsize=2)
+    for book_id in range(10):
+        assert versions.version(f'book:{book_id}') == 0
+    assert versions._seen.stats()['size'] == 2
+    with pool.connection() as db:
+        assert db.execute('SELECT COUNT(*) FROM cache_versions').fetchone()[0] == 0
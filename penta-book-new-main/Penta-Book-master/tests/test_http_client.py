@@ -0,0 +1,81 @@
+import pytest
+import requests
+
+from http_client import CircuitBreaker, UpstreamClient, UpstreamUnavailable
+
+
+def test_breaker_opens_after_threshold_and_probes_after_timeout(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('http_client.time.monotonic', lambda: now[0])
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open' and not breaker.allow()
+
+    now[0] += 10
+    assert breaker.allow() and breaker.state == 'half_open'
+    assert not breaker.allow()  # only one probe at a time
+    breaker.record_failure()
+    assert breaker.state == 'open'
+
+    now[0] += 10
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed' and breaker.allow()
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr('http_client.time.sleep', lambda seconds: None)
+    return UpstreamClient('test', 'http://upstream.invalid', retries=2, failure_threshold=3, reset_timeout=0)
+
+
+def respond_with(client, monkeypatch, *outcomes):
+    calls = []
+
+    def request(method, url, **kwargs):
+        outcome = outcomes[len(calls)]
+        calls.append(url)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+    monkeypatch.setattr(client.session, 'request', request)
+    return calls
+
+
+def test_retries_idempotent_requests_and_closes_discarded_responses(client, monkeypatch, fake_response):
+    busy, ok = fake_response(503), fake_response(200)
+    calls = respond_with(client, monkeypatch, requests.ConnectionError(), busy, ok)
+    assert client.get('/ping') is ok
+    assert len(calls) == 3
+    assert busy.closed and not ok.closed
+    assert client.stats()['retries'] == 2
+
+
+def test_non_idempotent_requests_are_not_retried(client, monkeypatch, fake_response):
+    calls = respond_with(client, monkeypatch, fake_response(503), fake_response(200))
+    assert client.post('/charge').status_code == 503
+    assert len(calls) == 1
+
+
+def test_open_breaker_fails_fast(client, monkeypatch):
+    client.breaker.reset_timeout = 60
+    respond_with(client, monkeypatch, *[requests.Timeout()] * 3)
+    with pytest.raises(requests.Timeout):
+        client.get('/ping')
+    with pytest.raises(UpstreamUnavailable):
+        client.get('/ping')
+    assert client.stats()['rejected'] == 1
+
+
+def test_unexpected_error_during_probe_reopens_the_breaker(client, monkeypatch, fake_response):
+    client.breaker.state = 'open'
+    respond_with(client, monkeypatch, ValueError('bad response'), fake_response(200))
+    with pytest.raises(ValueError):
+        client.post('/charge')
+    assert client.breaker.state == 'open'
+    # The next probe is let through and closes it again.
+    assert client.post('/charge').status_code == 200
+    assert client.breaker.state == 'closed'
@@ -0,0 +1,75 @@
+import threading
+import time
+
+import pytest
+
+from idempotency import IN_PROGRESS, IdempotencyStore
+
+
+@pytest.fixture
+def store(pool):
+    return IdempotencyStore(pool, 'test', ttl=60, lease=60)
+
+
+def test_replay_returns_the_first_response(store):
+    assert store.begin('k1') is None
+    store.complete('k1', 200, {'status': 'success', 'id': 1})
+    assert store.begin('k1') == (200, {'status': 'success', 'id': 1})
+    # A later completion for the same key does not replace the remembered answer.
+    store.complete('k1', 500, {'status': 'error'})
+    assert store.begin('k1') == (200, {'status': 'success', 'id': 1})
+
+
+def test_claim_in_progress_conflicts(store):
+    assert store.begin('k2') is None
+    assert store.begin('k2') is IN_PROGRESS
+
+
+def test_only_one_of_many_concurrent_claims_wins(store):
+    barrier = threading.Barrier(8)
+    results = []
+
+    def claim():
+        barrier.wait()
+        results.append(store.begin('k3'))
+
+    threads = [threading.Thread(target=claim) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results.count(None) == 1
+    assert results.count(IN_PROGRESS) == 7
+
+
+def test_released_key_can_be_claimed_again(store):
+    assert store.begin('k4') is None
+    store.release('k4')
+    assert store.begin('k4') is None
+
+
+def test_expired_lease_is_taken_over(pool):
+    store = IdempotencyStore(pool, 'test', ttl=60, lease=0.05)
+    assert store.begin('k5') is None
+    assert store.begin('k5') is IN_PROGRESS
+    time.sleep(0.1)
+    assert store.begin('k5') is None
+    # A finished key keeps its answer no matter how old its lease is.
+    store.complete('k5', 201, {'ok': True})
+    time.sleep(0.1)
+    assert store.begin('k5') == (201, {'ok': True})
+
+
+def test_expired_entries_are_forgotten(pool):
+    store = IdempotencyStore(pool, 'test', ttl=0.05, lease=60)
+    assert store.begin('k6') is None
+    store.complete('k6', 200, {})
+    time.sleep(0.1)
+    assert store.begin('k6') is None
+
+
+def test_scopes_are_independent(pool):
+    app_store = IdempotencyStore(pool, 'app')
+    gateway_store = IdempotencyStore(pool, 'gateway')
+    assert app_store.begin('same') is None
+    assert gateway_store.begin('same') is None
@@ -0,0 +1,56 @@
+import sqlite3
+import threading
+
+import migrate
+
+
+def latest_version():
+    return migrate.available_migrations()[-1][0]
+
+
+def test_upgrade_applies_every_migration_once(base_db):
+    db = sqlite3.connect(base_db)
+    applied = migrate.upgrade(db)
+    assert [number for number, _ in applied] == [number for number, _, _ in migrate.available_migrations()]
+    assert migrate.upgrade(db) == []
+    assert migrate.current_version(db) == latest_version()
+    db.close()
+
+
+def test_upgrade_stops_at_target(base_db):
+    db = sqlite3.connect(base_db)
+    migrate.upgrade(db, target=3)
+    assert migrate.current_version(db) == 3
+    migrate.upgrade(db)
+    assert migrate.current_version(db) == latest_version()
+    db.close()
+
+
+def test_concurrent_upgrades_apply_each_migration_once(base_db):
+    runners = 6
+    barrier = threading.Barrier(runners)
+    applied, errors = [], []
+
+    def run():
+        db = sqlite3.connect(base_db, timeout=30)
+        try:
+            barrier.wait()
+            applied.extend(migrate.upgrade(db))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            db.close()
+
+    threads = [threading.Thread(target=run) for _ in range(runners)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    # Between them the runners applied every migration exactly once.
+    assert sorted(applied) == [(number, name) for number, name, _ in migrate.available_migrations()]
+    db = sqlite3.connect(base_db)
+    assert db.execute('SELECT COUNT(*), MAX(version) FROM schema_version').fetchone() == (
+        len(migrate.available_migrations()), latest_version())
+    db.close()
@@ -0,0 +1,89 @@
+import sqlite3
+
+import pytest
+
+from pagination import decode_cursor, encode_cursor, keyset_page
+
+KEYS = [('price', 'price'), ('book_id', 'book_id')]
+
+
+@pytest.fixture
+def db():
+    db = sqlite3.connect(':memory:')
+    db.row_factory = sqlite3.Row
+    db.execute('CREATE TABLE books (book_id INTEGER PRIMARY KEY, price REAL, stock INTEGER)')
+    db.execute('CREATE INDEX idx_books_price ON books (price, book_id)')
+    # Few distinct prices, so most page boundaries fall inside a run of equal prices.
+    db.executemany('INSERT INTO books (book_id, price, stock) VALUES (?, ?, ?)',
+                   [(i, float(i * 7 % 5), i % 3) for i in range(1, 48)])
+    yield db
+    db.close()
+
+
+def expected(db, descending, where='1'):
+    direction = 'DESC' if descending else 'ASC'
+    return [row['book_id'] for row in db.execute(
+        f'SELECT book_id FROM books WHERE {where} ORDER BY price {direction}, book_id {direction}')]
+
+
+def walk_forward(db, descending, limit, where=(), params=()):
+    pages, after = [], None
+    while True:
+        page = keyset_page(db, 'SELECT book_id, price FROM books', where, params, KEYS,
+                           descending=descending, limit=limit, after=after)
+        pages.append(page)
+        if page.next_cursor is None:
+            return pages
+        after = page.next_cursor
+
+
+@pytest.mark.parametrize('descending', [False, True])
+@pytest.mark.parametrize('limit', [1, 4, 5, 47, 100])
+def test_forward_pages_cover_every_row_once_in_order(db, descending, limit):
+    pages = walk_forward(db, descending, limit)
+    seen = [row['book_id'] for page in pages for row in page.rows]
+    assert seen == expected(db, descending)
+    assert all(len(page.rows) == limit for page in pages[:-1])
+    assert pages[0].prev_cursor is None
+
+
+@pytest.mark.parametrize('descending', [False, True])
+def test_backward_pages_mirror_forward_pages(db, descending):
+    pages = walk_forward(db, descending, 6)
+    before = pages[-1].prev_cursor
+    for page in reversed(pages[:-1]):
+        back = keyset_page(db, 'SELECT book_id, price FROM books', [], [], KEYS,
+                           descending=descending, limit=6, before=before)
+        assert [row['book_id'] for row in back.rows] == [row['book_id'] for row in page.rows]
+        assert back.next_cursor is not None
+        before = back.prev_cursor
+    assert before is None
+
+
+def test_filters_apply_across_pages(db):
+    pages = walk_forward(db, False, 3, where=['stock = ?'], params=[1])
+    seen = [row['book_id'] for page in pages for row in page.rows]
+    assert seen == expected(db, False, 'stock = 1')
+
+
+def test_bad_cursor_starts_from_the_first_page(db):
+    first = keyset_page(db, 'SELECT book_id, price FROM books', [], [], KEYS, limit=5)
+    for cursor in ('not-base64!', encode_cursor([1]), encode_cursor(['a', 'b', 'c'])):
+        page = keyset_page(db, 'SELECT book_id, price FROM books', [], [], KEYS, limit=5, after=cursor)
+        assert [row['book_id'] for row in page.rows] == [row['book_id'] for row in first.rows]
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor([12.5, 'x', None])) == [12.5, 'x', None]
+    assert decode_cursor('') is None
+
+
+def test_deep_pages_seek_the_index(db):
+    first = keyset_page(db, 'SELECT book_id, price FROM books', [], [], KEYS, limit=5)
+    statements = []
+    db.set_trace_callback(statements.append)
+    keyset_page(db, 'SELECT book_id, price FROM books', [], [], KEYS, limit=5, after=first.next_cursor)
+    db.set_trace_callback(None)
+    plan = ' '.join(row[3] for row in db.execute('EXPLAIN QUERY PLAN ' + statements[-1]))
+    assert 'INDEX idx_books_price (price>?)' in plan
+    assert 'TEMP B-TREE' not in plan
@@ -0,0 +1,75 @@
+import threading
+
+import pytest
+
+from passwords import AttemptLimiter, PasswordHasher, hash_parameters
+
+
+def test_limiter_locks_out_after_the_limit():
+    limiter = AttemptLimiter({'account': 3}, window=60)
+    keys = [('account', 'buyer:alice@10.0.0.1')]
+    assert [limiter.reserve(keys) for _ in range(3)] == [0.0, 0.0, 0.0]
+    wait = limiter.reserve(keys)
+    assert 0 < wait <= 60
+
+
+def test_refund_gives_back_successful_attempts():
+    limiter = AttemptLimiter({'account': 2}, window=60)
+    keys = [('account', 'a')]
+    for _ in range(10):
+        assert limiter.reserve(keys) == 0.0
+        limiter.refund(keys)
+
+
+def test_any_exhausted_scope_blocks_and_rejected_attempts_are_not_counted():
+    limiter = AttemptLimiter({'account': 5, 'ip': 2}, window=60)
+    assert limiter.reserve([('account', 'a'), ('ip', '1')]) == 0.0
+    assert limiter.reserve([('account', 'b'), ('ip', '1')]) == 0.0
+    assert limiter.reserve([('account', 'c'), ('ip', '1')]) > 0
+    # The refused attempt did not use up account c's budget.
+    assert limiter.reserve([('account', 'c'), ('ip', '2')]) == 0.0
+    assert limiter.stats()['size'] == 5
+
+
+def test_scopes_can_have_their_own_window():
+    limiter = AttemptLimiter({'account': 1, 'account_global': 2}, window=1, windows={'account_global': 3600})
+    assert limiter.reserve([('account', 'x@1'), ('account_global', 'x')]) == 0.0
+    assert limiter.reserve([('account', 'x@2'), ('account_global', 'x')]) == 0.0
+    assert limiter.reserve([('account', 'x@3'), ('account_global', 'x')]) > 1
+
+
+def test_concurrent_reservations_never_exceed_the_limit():
+    limiter = AttemptLimiter({'account': 5}, window=60)
+    barrier = threading.Barrier(20)
+    granted = []
+
+    def attempt():
+        barrier.wait()
+        granted.append(limiter.reserve([('account', 'a')]) == 0.0)
+
+    threads = [threading.Thread(target=attempt) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert granted.count(True) == 5
+
+
+@pytest.mark.parametrize('method, expected', [
+    ('pbkdf2:sha256:1000', ('pbkdf2:sha256', (1000,))),
+    ('scrypt:16384:8:1', ('scrypt', (16384, 8, 1))),
+])
+def test_hash_parameters(method, expected):
+    assert hash_parameters(method) == expected
+
+
+def test_hasher_verifies_and_only_rehashes_weaker_hashes():
+    hasher = PasswordHasher('pbkdf2:sha256', iterations=2000, workers=0)
+    stored = hasher.hash('secret')
+    assert hasher.verify(stored, 'secret')
+    assert not hasher.verify(stored, 'wrong')
+    assert not hasher.verify(None, 'secret')
+    assert not hasher.needs_rehash(stored)
+    assert PasswordHasher('pbkdf2:sha256', iterations=4000, workers=0).needs_rehash(stored)
+    assert not PasswordHasher('pbkdf2:sha256', iterations=1000, workers=0).needs_rehash(stored)
+    assert PasswordHasher('scrypt', workers=0).needs_rehash(stored)
@@ -0,0 +1,55 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerPool:
+    """Runs `handler` repeatedly on a few daemon threads.
+
+    `handler()` returns True when it found work, in which case it is called again at once;
+    otherwise the thread sleeps for `poll_interval` seconds or until `notify()` is called.
+    """
+
+    def __init__(self, name, handler, threads=1, poll_interval=1.0):
+        self.name = name
+        self.handler = handler
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                worked = self.handler()
+            except Exception:
+                logger.exception('%s worker failed', self.name)
+                worked = False
+            if not worked:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return self
+            for i in range(self.threads):
+                thread = threading.Thread(target=self._run, name=f'{self.name}-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        return self
+
+    def notify(self):
+        self._wake.set()
+
+    def stop(self, timeout=5.0):
+        self._stopping.set()
+        self._wake.set()
+        with self._lock:
+            for thread in self._threads:
+                thread.join(timeout)
+            self._threads = []
+            self._stopping.clear()